@@ -7,7 +7,12 @@ Example: Middleware handler in django (the request is passed from one middleware
 
 """
 from __future__ import annotations
+
+import asyncio
+import sys
+import timeit
 from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional
 
 
 class Handler(ABC):
@@ -18,27 +23,162 @@ class Handler(ABC):
         # return the handler when setting the next handler, so it is easier to chain
         return handler
 
+    def _pass_to_next_handler(self, request: str) -> Optional[int]:
+        # The end of the chain returns None rather than failing when nobody handled the request
+        if self._next_handler is None:
+            return None
+        return self._next_handler.handle_request(request=request)
+
     @abstractmethod
     def handle_request(self, request: str) -> int:
         pass
 
 
-class ConcreteHandler1(Handler):
+class ExactMatchHandler(Handler):
+    """
+    Handles a request only when it is equal to `match_value`. Because the condition is just an equality check, compile_chain() can fold runs of these
+    handlers into a single dictionary lookup.
+    """
+
+    def __init__(self, match_value: Any, result: int):
+        self.match_value = match_value
+        self.result = result
 
     def handle_request(self, request: str) -> int:
-        if request == "some value":
-            return 4
+        if request == self.match_value:
+            return self.result
         else:
-            return self._next_handler.handle_request(request=request)
+            return self._pass_to_next_handler(request=request)
 
 
-class ConcreteHandler2(Handler):
+class PredicateHandler(Handler):
+
+    def __init__(self, predicate: Callable[[Any], bool], result: int):
+        self.predicate = predicate
+        self.result = result
 
     def handle_request(self, request: str) -> int:
-        if request == "another value":
-            return 20
+        if self.predicate(request):
+            return self.result
         else:
-            return self._next_handler.handle_request(request=request)
+            return self._pass_to_next_handler(request=request)
+
+
+class ConcreteHandler1(ExactMatchHandler):
+
+    def __init__(self):
+        super().__init__(match_value="some value", result=4)
+
+
+class ConcreteHandler2(ExactMatchHandler):
+
+    def __init__(self):
+        super().__init__(match_value="another value", result=20)
+
+
+class CompiledChain(Handler):
+    """
+    A chain of handlers flattened into a list of stages which is walked with a loop, so a request costs one Python frame no matter how long the chain
+    is. Each stage is either a dict (a run of exact match handlers) or a predicate. Any other handler can't be looked inside of, so it becomes the last
+    stage and handles the rest of the chain itself.
+    """
+
+    def __init__(self, first_handler: Handler, fallback: Optional[int] = None):
+        self.__stages: [Any] = []
+        self.__tail: Optional[Handler] = None
+        self.__fallback = fallback
+
+        handler = first_handler
+        while handler is not None:
+            if isinstance(handler, ExactMatchHandler):
+                if not self.__stages or not isinstance(self.__stages[-1], dict):
+                    self.__stages.append({})
+                # An earlier handler for the same value would have handled the request first
+                self.__stages[-1].setdefault(handler.match_value, handler.result)
+            elif isinstance(handler, PredicateHandler):
+                self.__stages.append((handler.predicate, handler.result))
+            else:
+                self.__tail = handler
+                break
+            handler = handler._next_handler
+
+    def handle_request(self, request: str) -> int:
+        for stage in self.__stages:
+            if type(stage) is dict:
+                try:
+                    result = stage.get(request)
+                except TypeError:
+                    # An unhashable request can't equal any of the values, same as it not matching the handlers one by one
+                    continue
+                if result is not None:
+                    return result
+            else:
+                predicate, result = stage
+                if predicate(request):
+                    return result
+
+        if self.__tail is not None:
+            result = self.__tail.handle_request(request=request)
+            if result is not None:
+                return result
+        return self.__fallback
+
+
+def compile_chain(first_handler: Handler, fallback: Optional[int] = None) -> CompiledChain:
+    return CompiledChain(first_handler=first_handler, fallback=fallback)
+
+
+class AsyncHandler(ABC):
+    """
+    Handler for chains whose handlers do I/O. A handler returns None from process() to pass the request on, and the chain is walked with a loop rather
+    than by each handler calling the next one.
+    """
+    _next_handler: AsyncHandler = None
+
+    def set_next_handler(self, handler: AsyncHandler) -> AsyncHandler:
+        self._next_handler = handler
+        return handler
+
+    @abstractmethod
+    async def process(self, request: str) -> Optional[int]:
+        pass
+
+    async def handle_request(self, request: str) -> Optional[int]:
+        handler = self
+        while handler is not None:
+            result = await handler.process(request)
+            if result is not None:
+                return result
+            handler = handler._next_handler
+        return None
+
+    async def handle_requests(self, batch: [str], concurrency: int = 100) -> [Optional[int]]:
+        """
+        Pushes the whole batch through one handler at a time, with at most `concurrency` requests in flight, so a slow handler is waited on once per
+        batch rather than once per request. Results are returned in the same order as the batch.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        semaphore = asyncio.Semaphore(concurrency)
+        results: [Optional[int]] = [None] * len(batch)
+        pending = list(range(len(batch)))
+
+        async def process(handler: AsyncHandler, index: int) -> Optional[int]:
+            async with semaphore:
+                return await handler.process(batch[index])
+
+        handler = self
+        while handler is not None and pending:
+            stage_results = await asyncio.gather(*(process(handler, index) for index in pending))
+            still_pending = []
+            for index, result in zip(pending, stage_results):
+                if result is None:
+                    still_pending.append(index)
+                else:
+                    results[index] = result
+            pending = still_pending
+            handler = handler._next_handler
+        return results
 
 
 class Client:
@@ -46,6 +186,38 @@ class Client:
     def process_request(self, handler: Handler) -> int:
         return handler.handle_request(request="some data")
 
+    async def process_requests(self, handler: AsyncHandler, requests: [str], concurrency: int = 100) -> [Optional[int]]:
+        return await handler.handle_requests(batch=requests, concurrency=concurrency)
+
+
+class ConcreteAsyncHandler(AsyncHandler):
+
+    def __init__(self, match_value: str, result: int):
+        self.__match_value = match_value
+        self.__result = result
+
+    async def process(self, request: str) -> Optional[int]:
+        # Stands in for a handler that has to wait on I/O
+        await asyncio.sleep(0.01)
+        if request == self.__match_value:
+            return self.__result
+        return None
+
+
+def benchmark():
+    for chain_length in (10, 100, 1_000, 10_000):
+        first_handler = handler = ExactMatchHandler(match_value=0, result=0)
+        for index in range(1, chain_length):
+            handler = handler.set_next_handler(handler=ExactMatchHandler(match_value=index, result=index))
+        compiled = compile_chain(first_handler=first_handler, fallback=-1)
+
+        last_value = chain_length - 1
+        compiled_time = min(timeit.repeat(lambda: compiled.handle_request(request=last_value), number=10_000, repeat=3))
+        print(f"chain of {chain_length}: compiled {compiled_time / 10_000 * 1e9:.0f}ns per request")
+        if chain_length < sys.getrecursionlimit() // 2:
+            chained_time = min(timeit.repeat(lambda: first_handler.handle_request(request=last_value), number=100, repeat=3))
+            print(f"chain of {chain_length}: recursive {chained_time / 100 * 1e9:.0f}ns per request")
+
 
 def main():
     client = Client()
@@ -54,6 +226,24 @@ def main():
     handler_1.set_next_handler(handler=handler_2)
     client.process_request(handler=handler_1)
 
+    handler_2.set_next_handler(handler=PredicateHandler(predicate=lambda request: request.startswith("some"), result=1))
+    compiled = compile_chain(first_handler=handler_1, fallback=0)
+    assert compiled.handle_request(request="another value") == 20
+    assert client.process_request(handler=compiled) == 1
+    assert compiled.handle_request(request="unknown") == 0
+
+    list_handler = ExactMatchHandler(match_value=1, result=1)
+    list_handler.set_next_handler(handler=PredicateHandler(predicate=lambda request: isinstance(request, list), result=2))
+    assert list_handler.handle_request(request=[1]) == compile_chain(first_handler=list_handler).handle_request(request=[1]) == 2
+
+    async_handler = ConcreteAsyncHandler(match_value="some value", result=4)
+    async_handler.set_next_handler(handler=ConcreteAsyncHandler(match_value="another value", result=20))
+    results = asyncio.run(client.process_requests(handler=async_handler, requests=["another value", "some value", "unknown"] * 100))
+    assert results[:3] == [20, 4, None]
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
@@ -5,8 +5,12 @@ thing calling the call back also doesn't need to know what information the call
 Example: You have a stock order executor class. It can call .execute() on any stock order. But the executor doesn't need to know if its a build or sell stock order.
 It can call the stock orders at any given time
 """
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Optional
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, Optional
 
 
 class CommandInterface(ABC):
@@ -16,6 +20,20 @@ class CommandInterface(ABC):
         pass
 
 
+class MergeableCommandInterface(CommandInterface):
+    """
+    A command that can be combined with the command queued right after it, e.g. two writes to the same place, so that only one command is executed.
+    """
+
+    @abstractmethod
+    def can_merge_with(self, other: CommandInterface) -> bool:
+        pass
+
+    @abstractmethod
+    def merge_with(self, other: CommandInterface) -> CommandInterface:
+        pass
+
+
 class ConcreteCommand(CommandInterface):
 
     def __init__(self, required_data_for_command: str):
@@ -26,8 +44,8 @@ class ConcreteCommand(CommandInterface):
 
 
 class CommandExecutor:
-    __before_start_operation: Optional[CommandInterface]
-    __after_operation_end: Optional[CommandInterface]
+    __before_start_operation: Optional[CommandInterface] = None
+    __after_operation_end: Optional[CommandInterface] = None
 
     def set_before_operation_starts_command(self, command: CommandInterface):
         self.__before_start_operation = command
@@ -48,6 +66,124 @@ class CommandExecutor:
         self.__after_operation_end = command
 
 
+class QueuedCommandExecutor:
+    """
+    Executes a stream of commands on a pool of `max_workers` threads. At most `max_queue_depth` commands are queued or running at once, run() blocks
+    on the stream until there is room. Adjacent mergeable commands are merged, up to `max_batch_size` at a time, before they are queued.
+
+    run() is lazy, commands are only read from the stream and submitted as the caller iterates over it. It yields one completed Future per (merged)
+    command, so a command that raised doesn't stop the others: its exception is raised by that Future's result(). In ordered mode the Futures are
+    yielded in the order the commands were given, otherwise as soon as they complete.
+    """
+
+    def __init__(self, max_workers: int = 4, ordered: bool = True, max_queue_depth: int = 1000, max_batch_size: int = 32):
+        if max_workers < 1 or max_queue_depth < 1 or max_batch_size < 1:
+            raise ValueError("max_workers, max_queue_depth and max_batch_size must be at least 1")
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.__ordered = ordered
+        self.__max_queue_depth = max_queue_depth
+        self.__max_batch_size = max_batch_size
+        self.__lock = threading.Lock()
+        self.__started_at: Optional[float] = None
+        self.queue_depth = 0
+        self.max_queue_depth_seen = 0
+        self.commands_received = 0
+        self.commands_executed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def __merge_adjacent(self, commands: Iterable[CommandInterface]) -> Iterator[CommandInterface]:
+        current: Optional[CommandInterface] = None
+        batch_size = 0
+        for command in commands:
+            self.commands_received += 1
+            if (current is not None and batch_size < self.__max_batch_size and isinstance(current, MergeableCommandInterface)
+                    and current.can_merge_with(command)):
+                current = current.merge_with(command)
+                batch_size += 1
+                continue
+            if current is not None:
+                yield current
+            current = command
+            batch_size = 1
+        if current is not None:
+            yield current
+
+    def __execute(self, command: CommandInterface, queued_at: float) -> Any:
+        try:
+            return command.execute_command()
+        finally:
+            latency = time.perf_counter() - queued_at
+            with self.__lock:
+                self.queue_depth -= 1
+                self.commands_executed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def __submit(self, command: CommandInterface) -> Future:
+        with self.__lock:
+            self.queue_depth += 1
+            self.max_queue_depth_seen = max(self.max_queue_depth_seen, self.queue_depth)
+        return self.__pool.submit(self.__execute, command, time.perf_counter())
+
+    def run(self, commands: Iterable[CommandInterface]) -> Iterator[Future]:
+        if self.__started_at is None:
+            self.__started_at = time.perf_counter()
+        in_flight: deque[Future] = deque()
+        for command in self.__merge_adjacent(commands):
+            if len(in_flight) >= self.__max_queue_depth:
+                yield from self.__collect(in_flight=in_flight, wait_for_all=False)
+            in_flight.append(self.__submit(command))
+        yield from self.__collect(in_flight=in_flight, wait_for_all=True)
+
+    def __collect(self, in_flight: deque, wait_for_all: bool) -> Iterator[Future]:
+        if self.__ordered:
+            while in_flight:
+                future = in_flight.popleft()
+                wait([future])
+                yield future
+                if not wait_for_all:
+                    return
+            return
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                yield future
+            if not wait_for_all:
+                return
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.commands_executed if self.commands_executed else 0.0
+
+    @property
+    def throughput(self) -> float:
+        # Commands executed per second since the first call to run()
+        if self.__started_at is None:
+            return 0.0
+        return self.commands_executed / (time.perf_counter() - self.__started_at)
+
+    def shutdown(self):
+        self.__pool.shutdown(wait=True)
+
+
+class AppendTextCommand(MergeableCommandInterface):
+
+    def __init__(self, text: str):
+        self.__text = text
+
+    def execute_command(self) -> str:
+        return self.__text
+
+    def can_merge_with(self, other: CommandInterface) -> bool:
+        return isinstance(other, AppendTextCommand)
+
+    def merge_with(self, other: CommandInterface) -> CommandInterface:
+        return AppendTextCommand(text=self.__text + other.__text)
+
+
 def main():
     executor = CommandExecutor()
     command_1 = ConcreteCommand(required_data_for_command="Hello")
@@ -58,6 +194,13 @@ def main():
 
     executor.important_operation()
 
+    queued_executor = QueuedCommandExecutor(max_workers=4, max_batch_size=3)
+    commands = [AppendTextCommand(text=letter) for letter in "abcdefg"]
+    assert [future.result() for future in queued_executor.run(commands)] == ["abc", "def", "g"]
+    print(f"executed={queued_executor.commands_executed} received={queued_executor.commands_received} "
+          f"average latency={queued_executor.average_latency * 1e6:.0f}us throughput={queued_executor.throughput:.0f}/s")
+    queued_executor.shutdown()
+
 
 if __name__ == "__main__":
     main()
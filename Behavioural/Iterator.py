@@ -2,16 +2,130 @@
 Why: You want to iterate over some collection, but want to decouple this iteration from the implementation of the collection. E.g. you might have a set,
 dictionary or list which hold int values. You maybe not care which data structure it uses, just that you want to iterate over it
 """
+from __future__ import annotations
+
+import mmap
+import os
+import queue
+import sys
+import tempfile
+import threading
+import timeit
 from abc import ABC, abstractmethod
-from typing import Optional, Any
+from array import array
+from typing import Optional, Any, Iterator
 
 
 class CollectionOfWords:
-    words: [str] = []
+
+    def __init__(self):
+        self.words: [str] = []
 
     def append(self, word: str):
         self.words.append(word)
 
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def get_slice(self, start: int, stop: int) -> [str]:
+        return self.words[start:stop]
+
+    def __iter__(self) -> CollectionOfWordsIterator:
+        return CollectionOfWordsIterator(word_collection=self)
+
+
+class CompactCollectionOfWords(CollectionOfWords):
+    """
+    Stores the words in one contiguous UTF-8 buffer, each word followed by a newline, plus an array of where each word starts. This costs a few bytes per
+    word rather than a Python object per word. The buffer can also be a memory mapped word file, see from_file().
+
+    The buffer is never resized in place, so views from get_bytes() can be held while appending. When it is full, append() moves the words to a new
+    buffer of twice the size. Views taken before that still show the right word but keep the old buffer alive, take new views after growing.
+    """
+
+    def __init__(self):
+        self.__buffer = bytearray()
+        # Word i is buffer[offsets[i]:offsets[i + 1] - 1], the last offset is the end of the words in the buffer
+        self.__offsets = array("Q", [0])
+        self.__map: Optional[mmap.mmap] = None
+        # A mapped file may not end with a newline, then the last word runs to the end of the buffer instead
+        self.__last_word_unterminated = False
+
+    @classmethod
+    def from_file(cls, path: str) -> CompactCollectionOfWords:
+        # Maps a newline separated word file. Only the offsets are built in memory, the words are read from the page cache as they are needed
+        collection = cls()
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return collection
+            collection.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = collection.__map
+        offsets = collection.__offsets
+        position = buffer.find(b"\n")
+        while position != -1:
+            offsets.append(position + 1)
+            position = buffer.find(b"\n", position + 1)
+        if offsets[-1] != len(buffer):
+            offsets.append(len(buffer))
+            collection.__last_word_unterminated = True
+        return collection
+
+    @property
+    def words(self) -> [str]:
+        return self.get_slice(0, len(self))
+
+    def append(self, word: str):
+        if "\n" in word:
+            raise ValueError("words can't contain a newline")
+        encoded = word.encode("utf-8") + b"\n"
+        end = self.__offsets[-1]
+        if self.__map is not None or end + len(encoded) > len(self.__buffer):
+            # A mapped file is read only, so the first append copies it into memory, as does outgrowing the current buffer
+            old_buffer = self.__map if self.__map is not None else self.__buffer
+            new_buffer = bytearray(max(2 * len(old_buffer), end + len(encoded) + 1, 64))
+            new_buffer[:end] = memoryview(old_buffer)[:end]
+            if self.__last_word_unterminated:
+                new_buffer[end] = ord("\n")
+                end += 1
+                self.__offsets[-1] = end
+                self.__last_word_unterminated = False
+            old_map = self.__map
+            self.__buffer = new_buffer
+            self.__map = None
+            if old_map is not None:
+                try:
+                    old_map.close()
+                except BufferError:
+                    # Views from get_bytes() still point into the map, it is closed once they are garbage collected
+                    pass
+        self.__buffer[end:end + len(encoded)] = encoded
+        self.__offsets.append(end + len(encoded))
+
+    def __len__(self) -> int:
+        return len(self.__offsets) - 1
+
+    def __buffer_view(self) -> memoryview:
+        return memoryview(self.__map if self.__map is not None else self.__buffer)
+
+    def __end_of_word(self, index: int) -> int:
+        if index == len(self) - 1 and self.__last_word_unterminated:
+            return self.__offsets[index + 1]
+        return self.__offsets[index + 1] - 1
+
+    def get_bytes(self, index: int) -> memoryview:
+        # The UTF-8 bytes of one word, without copying them
+        if not 0 <= index < len(self):
+            raise IndexError("word index out of range")
+        return self.__buffer_view()[self.__offsets[index]:self.__end_of_word(index)]
+
+    def get_slice(self, start: int, stop: int) -> [str]:
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return []
+        # Decoding the whole range at once and splitting it is much cheaper than decoding word by word
+        text = str(self.__buffer_view()[self.__offsets[start]:self.__end_of_word(stop - 1)], "utf-8")
+        return text.split("\n")
+
 
 class IteratorInterface(ABC):
 
@@ -19,20 +133,127 @@ class IteratorInterface(ABC):
     def next(self) -> Any:
         pass
 
+    # Python's iterator protocol, so iterators work in for loops and with itertools. next() is kept for clients written against the interface
+    def __iter__(self) -> IteratorInterface:
+        return self
+
+    def __next__(self) -> Any:
+        value = self.next()
+        if value is None:
+            raise StopIteration
+        return value
+
 
 class CollectionOfWordsIterator(IteratorInterface):
+    # Words are read from the collection this many at a time, the per word cost is then just a step of a list iterator
+    _BUFFER_SIZE = 4096
 
     def __init__(self, word_collection: CollectionOfWords):
         self._current_index = 0
         self._word_collection = word_collection
+        self._buffer: Iterator[str] = iter(())
 
     def next(self) -> Optional[str]:
-        index = self._current_index
-        self._current_index += 1
-        if index < len(self._word_collection.words):
-            return self._word_collection.words[index]
-        else:
-            return None
+        return next(self, None)
+
+    def __next__(self) -> str:
+        word = next(self._buffer, None)
+        if word is None:
+            chunk = self._word_collection.get_slice(self._current_index, self._current_index + self._BUFFER_SIZE)
+            if not chunk:
+                raise StopIteration
+            self._current_index += len(chunk)
+            self._buffer = iter(chunk)
+            word = next(self._buffer)
+        return word
+
+    def chunks(self, chunk_size: int) -> Iterator[[str]]:
+        # Yields the remaining words as lists of up to chunk_size words
+        remaining = list(self._buffer)
+        if remaining:
+            yield from (remaining[index:index + chunk_size] for index in range(0, len(remaining), chunk_size))
+        while True:
+            chunk = self._word_collection.get_slice(self._current_index, self._current_index + chunk_size)
+            if not chunk:
+                return
+            self._current_index += len(chunk)
+            yield chunk
+
+
+class PrefetchingIterator(IteratorInterface):
+    """
+    Wraps a chunked source that is slow to read from, e.g. a collection backed by the network. A background thread keeps up to `prefetch` chunks read
+    ahead of the consumer, so the wait for the next chunk overlaps with the consumer's work.
+    """
+    __END = object()
+    # How often a blocked background thread or consumer checks whether the iterator has been closed
+    _POLL_INTERVAL = 0.1
+
+    def __init__(self, chunks: Iterator[[str]], prefetch: int = 4):
+        self.__chunks: queue.Queue = queue.Queue(maxsize=prefetch)
+        self.__buffer: Iterator[str] = iter(())
+        self.__errors: [BaseException] = []
+        self.__stop = threading.Event()
+        # The thread is not given self, so an iterator that is dropped without being closed is still garbage collected and __del__ stops the thread
+        self.__thread = threading.Thread(target=self.__fill, args=(chunks, self.__chunks, self.__stop, self.__errors), daemon=True)
+        self.__thread.start()
+
+    @classmethod
+    def __put(cls, chunks: queue.Queue, stop: threading.Event, item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=cls._POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @classmethod
+    def __fill(cls, source: Iterator[[str]], chunks: queue.Queue, stop: threading.Event, errors: [BaseException]):
+        try:
+            for chunk in source:
+                if not cls.__put(chunks, stop, chunk):
+                    return
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            cls.__put(chunks, stop, cls.__END)
+
+    def next(self) -> Optional[str]:
+        return next(self, None)
+
+    def __next__(self) -> str:
+        word = next(self.__buffer, self.__END)
+        while word is self.__END:
+            if self.__stop.is_set():
+                raise StopIteration
+            try:
+                chunk = self.__chunks.get(timeout=self._POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if chunk is self.__END:
+                # Put the marker back, so calling next() again after the end doesn't block
+                self.__chunks.put(self.__END)
+                if self.__errors:
+                    raise self.__errors[0]
+                raise StopIteration
+            self.__buffer = iter(chunk)
+            word = next(self.__buffer, self.__END)
+        return word
+
+    def close(self):
+        # Stops the background thread once the chunk it is reading has been read, any words not yet consumed are dropped
+        self.__stop.set()
+        self.__buffer = iter(())
+
+    def __enter__(self) -> PrefetchingIterator:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
 
 
 def client(some_iterator: IteratorInterface) -> [str]:
@@ -45,14 +266,82 @@ def client(some_iterator: IteratorInterface) -> [str]:
     return values
 
 
+class _IndexCheckingIterator(IteratorInterface):
+    # The original element by element iterator, kept as the benchmark baseline
+
+    def __init__(self, word_collection: CollectionOfWords):
+        self._current_index = 0
+        self._word_collection = word_collection
+
+    def next(self) -> Optional[str]:
+        index = self._current_index
+        self._current_index += 1
+        if index < len(self._word_collection.words):
+            return self._word_collection.words[index]
+        else:
+            return None
+
+
+def benchmark(number_of_words: int = 10_000_000):
+    collection = CollectionOfWords()
+    collection.words = ["word"] * number_of_words
+
+    def consume(iterator: IteratorInterface):
+        for _ in iterator:
+            pass
+
+    next_loop_time = timeit.timeit(lambda: client(some_iterator=_IndexCheckingIterator(word_collection=collection)), number=1)
+    for_loop_time = timeit.timeit(lambda: consume(iter(collection)), number=1)
+    chunked_time = timeit.timeit(lambda: consume(CollectionOfWordsIterator(word_collection=collection).chunks(chunk_size=4096)), number=1)
+    print(f"{number_of_words} words: next() loop {next_loop_time:.2f}s, for loop {for_loop_time:.2f}s, chunks {chunked_time:.3f}s")
+
+
 def main():
     collection = CollectionOfWords()
     collection.append("word 1")
     collection.append("word 2")
     iterator = CollectionOfWordsIterator(word_collection=collection)
     values = client(some_iterator=iterator)
-    assert (values == ["word 1", ["word 2"]])
+    assert (values == ["word 1", "word 2"])
+
+    assert list(collection) == ["word 1", "word 2"]
+    assert list(CollectionOfWordsIterator(word_collection=collection).chunks(chunk_size=1)) == [["word 1"], ["word 2"]]
+    with PrefetchingIterator(chunks=CollectionOfWordsIterator(word_collection=collection).chunks(chunk_size=1)) as prefetching_iterator:
+        assert list(prefetching_iterator) == ["word 1", "word 2"]
+    with PrefetchingIterator(chunks=iter([["word"]] * 100), prefetch=1) as prefetching_iterator:
+        assert next(prefetching_iterator) == "word"
+    assert prefetching_iterator.next() is None
+
+    compact_collection = CompactCollectionOfWords()
+    compact_collection.append("word 1")
+    compact_collection.append("wörd 2")
+    assert list(CollectionOfWordsIterator(word_collection=compact_collection)) == ["word 1", "wörd 2"]
+    assert bytes(compact_collection.get_bytes(1)) == "wörd 2".encode("utf-8")
+    held_view = compact_collection.get_bytes(0)
+    for index in range(100):
+        compact_collection.append(f"word {index}")
+    assert bytes(held_view) == b"word 1" and len(compact_collection) == 102
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "words.txt")
+        with open(path, "wb") as file:
+            file.write(b"word 1\nword 2\n")
+        mapped_collection = CompactCollectionOfWords.from_file(path=path)
+        mapped_view = mapped_collection.get_bytes(1)
+        mapped_collection.append("word 3")
+        assert list(mapped_collection) == ["word 1", "word 2", "word 3"] and bytes(mapped_view) == b"word 2"
+        del mapped_view
+
+        with open(path, "wb") as file:
+            file.write(b"word 1\nword 2")
+        mapped_collection = CompactCollectionOfWords.from_file(path=path)
+        assert list(mapped_collection) == ["word 1", "word 2"] and bytes(mapped_collection.get_bytes(1)) == b"word 2"
+        mapped_collection.append("word 3")
+        assert list(mapped_collection) == ["word 1", "word 2", "word 3"] and bytes(mapped_collection.get_bytes(1)) == b"word 2"
 
 
 if __name__ == "__main__":
-    pass
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
@@ -3,8 +3,21 @@ Why: You want to have reusable components which can send events, another class m
 re-usability you use a mediator to dictate how these classes interact with each other.
 
 """
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import inspect
+import multiprocessing
+import os
+import struct
+import sys
+import time
 from abc import ABC, abstractmethod
-from typing import Optional
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterable, Optional
 
 
 class MediatorInterface(ABC):
@@ -62,6 +75,408 @@ class ConcreteMediator(MediatorInterface):
             self.__component_1.do_b()
 
 
+class EventBusMediator(MediatorInterface):
+    """
+    Routes events with a table of event -> handlers rather than a chain of if statements, so dispatching is one dictionary lookup. Events raised while
+    handling another event are queued and handled after it, rather than recursively, so a cascade of events doesn't grow the call stack.
+
+    Each route declares the events its handler emits. A route that would make an event lead back to itself is rejected when it is added, and as a last
+    line of defence a cascade of more than `max_cascade_length` events raises.
+    """
+
+    def __init__(self, max_cascade_length: int = 100_000):
+        self.__handlers: {str: (Callable[[object], Any], ...)} = {}
+        self.__emits: {str: {str}} = {}
+        self.__pending: deque = deque()
+        self.__dispatching = False
+        self._max_cascade_length = max_cascade_length
+        self.events_dispatched = 0
+
+    def register(self, component: BaseComponent):
+        component.set_mediator(mediator=self)
+
+    def add_route(self, event: str, handler: Callable[[object], Any], emits: Iterable[str] = ()):
+        emits = set(emits)
+        cycle = self.__find_path(from_events=emits, to_event=event)
+        if cycle is not None:
+            raise ValueError(f"routing {event} would create the cycle {' -> '.join([event] + cycle)}")
+        self.__handlers[event] = self.__handlers.get(event, ()) + (handler,)
+        self.__emits.setdefault(event, set()).update(emits)
+
+    def __find_path(self, from_events: {str}, to_event: str) -> Optional[[str]]:
+        # Depth first search through the declared emits, returns the events leading from one of from_events to to_event
+        stack = [(event, [event]) for event in from_events]
+        visited = set()
+        while stack:
+            event, path = stack.pop()
+            if event == to_event:
+                return path
+            if event in visited:
+                continue
+            visited.add(event)
+            stack.extend((emitted, path + [emitted]) for emitted in self.__emits.get(event, ()))
+        return None
+
+    def notify_mediator_of_event(self, sender: object, event: str):
+        self.__pending.append((sender, event))
+        if self.__dispatching:
+            # We're inside a handler, the event is handled once the current one is done
+            return
+        self._dispatch_pending()
+
+    def _dispatch_pending(self):
+        self.__dispatching = True
+        try:
+            cascade_length = 0
+            pending = self.__pending
+            handlers = self.__handlers
+            while pending:
+                sender, event = pending.popleft()
+                cascade_length += 1
+                if cascade_length > self._max_cascade_length:
+                    raise RuntimeError(f"more than {self._max_cascade_length} events were raised by a single event")
+                for handler in handlers.get(event, ()):
+                    handler(sender)
+            self.events_dispatched += cascade_length
+        except BaseException:
+            # The rest of the failed cascade must not be handled as part of whatever event comes next
+            self.__pending.clear()
+            raise
+        finally:
+            self.__dispatching = False
+
+    def _handlers_for(self, event: str) -> (Callable[[object], Any], ...):
+        return self.__handlers.get(event, ())
+
+
+class AsyncEventBusMediator(EventBusMediator):
+    """
+    Events are published to a bounded asyncio queue and handled by run(). publish() waits while the queue is full, which slows producers down to the
+    rate events are handled. Handlers may be coroutine functions. Events raised by handlers skip the queue, they are part of the cascade of the event
+    being handled, also when a coroutine handler raises them after awaiting something.
+
+    A handler that raises ends the cascade it is part of, not run(). The failure is counted in `cascades_failed` and passed to `on_error` along with
+    the event that started the cascade, then run() carries on with the next event, so join() still returns.
+    """
+
+    def __init__(self, max_queue_size: int = 10_000, max_cascade_length: int = 100_000,
+                 on_error: Optional[Callable[[object, str, Exception], Any]] = None):
+        super().__init__(max_cascade_length=max_cascade_length)
+        self.__queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.__on_error = on_error
+        self.cascades_failed = 0
+        # The cascade being handled by the current task. A context variable rather than an attribute, so that while a handler awaits, events raised
+        # by other tasks still go to the queue
+        self.__cascade: contextvars.ContextVar = contextvars.ContextVar(f"cascade_{id(self)}", default=None)
+
+    async def publish(self, sender: object, event: str):
+        await self.__queue.put((sender, event))
+
+    def notify_mediator_of_event(self, sender: object, event: str):
+        cascade = self.__cascade.get()
+        if cascade is not None:
+            cascade.append((sender, event))
+        else:
+            # Called from outside of a handler without awaiting, raises asyncio.QueueFull rather than blocking the event loop when the queue is full
+            self.__queue.put_nowait((sender, event))
+
+    async def run(self):
+        while True:
+            sender, event = await self.__queue.get()
+            try:
+                await self.__handle_cascade(sender=sender, event=event)
+            except Exception as error:
+                self.cascades_failed += 1
+                if self.__on_error is not None:
+                    self.__on_error(sender, event, error)
+            finally:
+                self.__queue.task_done()
+
+    async def join(self):
+        # Waits until every published event has been handled
+        await self.__queue.join()
+
+    async def __handle_cascade(self, sender: object, event: str):
+        cascade = deque([(sender, event)])
+        token = self.__cascade.set(cascade)
+        try:
+            cascade_length = 0
+            while cascade:
+                sender, event = cascade.popleft()
+                cascade_length += 1
+                if cascade_length > self._max_cascade_length:
+                    raise RuntimeError(f"more than {self._max_cascade_length} events were raised by a single event")
+                for handler in self._handlers_for(event):
+                    result = handler(sender)
+                    if inspect.isawaitable(result):
+                        await result
+            self.events_dispatched += cascade_length
+        finally:
+            self.__cascade.reset(token)
+
+
+class SharedMemoryRingBuffer:
+    """
+    Queue of byte messages in a multiprocessing.shared_memory block, so any process can write to it and the process owning it reads from it without
+    anything being pickled or sent through a pipe. The block starts with the total number of bytes ever written and ever read, followed by the ring of
+    length prefixed messages. A lock shared by the processes guards the counters.
+    """
+    __HEADER = struct.Struct("<QQ")
+    __LENGTH = struct.Struct("<I")
+
+    def __init__(self, capacity: int = 1 << 20, name: Optional[str] = None, lock=None):
+        if name is None:
+            self.__memory = shared_memory.SharedMemory(create=True, size=self.__HEADER.size + capacity)
+            self.__HEADER.pack_into(self.__memory.buf, 0, 0, 0)
+        else:
+            self.__memory = self.__attach(name=name)
+        self.__capacity = capacity
+        self.__lock = lock if lock is not None else multiprocessing.Lock()
+        self.__owner = name is None
+
+    @staticmethod
+    def __attach(name: str) -> shared_memory.SharedMemory:
+        # Only the owner's unlink() should end the block's tracking. Before Python 3.13 attaching always registers the block with the resource tracker,
+        # but child processes share their parent's tracker and it keeps a set of names, so that registration adds nothing and must not be undone
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            return shared_memory.SharedMemory(name=name)
+
+    def __getstate__(self) -> dict:
+        return {"capacity": self.__capacity, "name": self.__memory.name, "lock": self.__lock}
+
+    def __setstate__(self, state: dict):
+        self.__init__(capacity=state["capacity"], name=state["name"], lock=state["lock"])
+
+    def __copy(self, position: int, data) -> int:
+        start = self.__HEADER.size + position % self.__capacity
+        first_part = min(len(data), self.__HEADER.size + self.__capacity - start)
+        buffer = self.__memory.buf
+        buffer[start:start + first_part] = data[:first_part]
+        buffer[self.__HEADER.size:self.__HEADER.size + len(data) - first_part] = data[first_part:]
+        return position + len(data)
+
+    def write(self, message: bytes):
+        # Waits while the ring is too full for the message, which holds back a producer until the reader has caught up
+        size = self.__LENGTH.size + len(message)
+        if size > self.__capacity:
+            raise ValueError("message is larger than the ring buffer")
+        while True:
+            with self.__lock:
+                written, read = self.__HEADER.unpack_from(self.__memory.buf, 0)
+                if written + size - read <= self.__capacity:
+                    position = self.__copy(position=written, data=self.__LENGTH.pack(len(message)))
+                    position = self.__copy(position=position, data=message)
+                    self.__HEADER.pack_into(self.__memory.buf, 0, position, read)
+                    return
+            time.sleep(0)
+
+    def read_all(self) -> [bytes]:
+        # Takes every message written so far in one go, so the lock is taken once per batch rather than per message
+        with self.__lock:
+            written, read = self.__HEADER.unpack_from(self.__memory.buf, 0)
+            if written == read:
+                return []
+            start = self.__HEADER.size + read % self.__capacity
+            end = start + written - read
+            if end <= self.__HEADER.size + self.__capacity:
+                data = bytes(self.__memory.buf[start:end])
+            else:
+                data = (bytes(self.__memory.buf[start:self.__HEADER.size + self.__capacity])
+                        + bytes(self.__memory.buf[self.__HEADER.size:end - self.__capacity]))
+            self.__HEADER.pack_into(self.__memory.buf, 0, written, written)
+
+        messages = []
+        offset = 0
+        while offset < len(data):
+            (length,) = self.__LENGTH.unpack_from(data, offset)
+            offset += self.__LENGTH.size
+            messages.append(data[offset:offset + length])
+            offset += length
+        return messages
+
+    def close(self):
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+
+
+class SharedMemoryMediator(MediatorInterface):
+    """
+    Mediator for components living in different processes. Create it, and add every route, in the parent process before starting the workers, then
+    each process attaches to one of the `number_of_processes` slots and registers its components. Every slot has a ring buffer in shared memory. An
+    event is written to the ring of each slot that has a component handling it, and that slot's process calls the handlers when it polls.
+
+    The routes are copied into each worker when it starts, they are not shared. A route added after a worker has started is only known to the process
+    that added it.
+    """
+
+    def __init__(self, number_of_processes: int, ring_capacity: int = 1 << 20):
+        self.__rings = [SharedMemoryRingBuffer(capacity=ring_capacity) for _ in range(number_of_processes)]
+        # event -> ((slot, component name, method name), ...)
+        self.__routes: {str: ((int, str, str), ...)} = {}
+        # event -> the slots its handlers live in, so each slot is sent the event once
+        self.__target_slots: {str: (int, ...)} = {}
+        self.__slot: Optional[int] = None
+        self.__components: {str: BaseComponent} = {}
+
+    def add_route(self, event: str, slot: int, component_name: str, method_name: str):
+        if not 0 <= slot < len(self.__rings):
+            raise ValueError(f"there is no slot {slot}")
+        self.__routes[event] = self.__routes.get(event, ()) + ((slot, component_name, method_name),)
+        self.__target_slots[event] = tuple(sorted({route[0] for route in self.__routes[event]}))
+
+    def attach(self, slot: int):
+        # Called once in each process, events for this slot are handled by this process
+        self.__slot = slot
+
+    def register(self, name: str, component: BaseComponent):
+        self.__components[name] = component
+        component.set_mediator(mediator=self)
+
+    def notify_mediator_of_event(self, sender: object, event: str):
+        # The sender only exists in this process, so only the event is sent
+        message = event.encode("utf-8")
+        for slot in self.__target_slots.get(event, ()):
+            self.__rings[slot].write(message)
+
+    def poll(self) -> int:
+        # Handles every event waiting for this process' slot, returns how many were handled
+        if self.__slot is None:
+            raise RuntimeError("attach() to a slot before polling")
+        messages = self.__rings[self.__slot].read_all()
+        for message in messages:
+            for slot, component_name, method_name in self.__routes.get(message.decode("utf-8"), ()):
+                if slot == self.__slot:
+                    getattr(self.__components[component_name], method_name)()
+        return len(messages)
+
+    def close(self):
+        for ring in self.__rings:
+            ring.close()
+
+
+class _CountingComponent(BaseComponent):
+
+    def __init__(self):
+        self.count = 0
+
+    def do_count(self):
+        self.count += 1
+
+
+class _PingPongComponent(BaseComponent):
+
+    def __init__(self):
+        self.count = 0
+        self.finished = False
+
+    def do_count(self):
+        self.count += 1
+
+    def do_ping(self):
+        self._mediator.notify_mediator_of_event(sender=self, event="pong")
+
+    def do_pong(self):
+        self.count += 1
+
+    def do_finish(self):
+        self._mediator.notify_mediator_of_event(sender=self, event="finished")
+
+    def do_finished(self):
+        self.finished = True
+
+
+def _shared_memory_worker(mediator: SharedMemoryMediator, stop):
+    mediator.attach(slot=1)
+    mediator.register(name="worker", component=_PingPongComponent())
+    while not stop.is_set():
+        if mediator.poll() == 0:
+            time.sleep(0)
+
+
+def benchmark_shared_memory(number_of_events: int = 200_000, number_of_round_trips: int = 10_000):
+    mediator = SharedMemoryMediator(number_of_processes=2)
+    mediator.add_route(event="count", slot=1, component_name="worker", method_name="do_count")
+    mediator.add_route(event="ping", slot=1, component_name="worker", method_name="do_ping")
+    mediator.add_route(event="finish", slot=1, component_name="worker", method_name="do_finish")
+    mediator.add_route(event="pong", slot=0, component_name="main", method_name="do_pong")
+    mediator.add_route(event="finished", slot=0, component_name="main", method_name="do_finished")
+    stop = multiprocessing.Event()
+    worker = multiprocessing.Process(target=_shared_memory_worker, args=(mediator, stop))
+    worker.start()
+    mediator.attach(slot=0)
+    component = _PingPongComponent()
+    mediator.register(name="main", component=component)
+
+    try:
+        started_at = time.perf_counter()
+        for _ in range(number_of_events):
+            mediator.notify_mediator_of_event(sender=component, event="count")
+        mediator.notify_mediator_of_event(sender=component, event="finish")
+        while not component.finished:
+            mediator.poll()
+        print(f"shared memory mediator: {number_of_events / (time.perf_counter() - started_at):.0f} events/s to another process")
+
+        started_at = time.perf_counter()
+        for round_trip in range(number_of_round_trips):
+            mediator.notify_mediator_of_event(sender=component, event="ping")
+            while component.count <= round_trip:
+                mediator.poll()
+        round_trip_time = (time.perf_counter() - started_at) / number_of_round_trips
+        print(f"shared memory mediator: {round_trip_time * 1e6:.1f}us round trip latency")
+    finally:
+        stop.set()
+        worker.join()
+        mediator.close()
+
+    component_1 = Component1()
+    component_2 = Component2()
+    concrete_mediator = ConcreteMediator(component_1=component_1, component_2=component_2)
+    started_at = time.perf_counter()
+    for _ in range(number_of_events):
+        # An event nothing is routed for, so only the mediator's own cost is measured and nothing is printed
+        concrete_mediator.notify_mediator_of_event(sender=component_1, event="count")
+    print(f"in process ConcreteMediator: {number_of_events / (time.perf_counter() - started_at):.0f} events/s")
+
+    # A round trip for ConcreteMediator is "A", which makes component 2 do d, whose "D" makes component 1 do b. The components print, so that output
+    # is thrown away
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started_at = time.perf_counter()
+        for _ in range(number_of_round_trips):
+            concrete_mediator.notify_mediator_of_event(sender=component_1, event="A")
+        round_trip_time = (time.perf_counter() - started_at) / number_of_round_trips
+    print(f"in process ConcreteMediator: {round_trip_time * 1e6:.1f}us round trip latency")
+
+
+def benchmark(number_of_events: int = 1_000_000):
+    mediator = EventBusMediator()
+    component = _CountingComponent()
+    mediator.register(component=component)
+    mediator.add_route(event="count", handler=lambda sender: component.do_count())
+    started_at = time.perf_counter()
+    for _ in range(number_of_events):
+        mediator.notify_mediator_of_event(sender=None, event="count")
+    print(f"synchronous: {number_of_events / (time.perf_counter() - started_at):.0f} events/s")
+
+    async_mediator = AsyncEventBusMediator(max_queue_size=1_000)
+    async_mediator.add_route(event="count", handler=lambda sender: component.do_count())
+
+    async def publish_all():
+        consumer = asyncio.create_task(async_mediator.run())
+        for _ in range(number_of_events):
+            await async_mediator.publish(sender=None, event="count")
+        await async_mediator.join()
+        consumer.cancel()
+
+    started_at = time.perf_counter()
+    asyncio.run(publish_all())
+    print(f"asyncio: {number_of_events / (time.perf_counter() - started_at):.0f} events/s")
+
+    benchmark_shared_memory()
+
+
 def main():
     component_1 = Component1()
     component_2 = Component2()
@@ -71,6 +486,96 @@ def main():
 
     component_2.do_d()
 
+    event_bus = EventBusMediator()
+    event_bus.register(component=component_1)
+    event_bus.register(component=component_2)
+    event_bus.add_route(event="A", handler=lambda sender: component_2.do_d(), emits=["D"])
+    event_bus.add_route(event="D", handler=lambda sender: component_1.do_b(), emits=["B"])
+    component_1.do_a()
+    try:
+        event_bus.add_route(event="B", handler=lambda sender: component_1.do_a(), emits=["A"])
+        raise AssertionError("the cycle B -> A -> D -> B should have been rejected")
+    except ValueError as error:
+        print(error)
+
+    async def run_async_event_bus():
+        async_event_bus = AsyncEventBusMediator(max_queue_size=10)
+        async_event_bus.register(component=component_1)
+        async_event_bus.register(component=component_2)
+        async_event_bus.add_route(event="A", handler=lambda sender: component_2.do_d(), emits=["D"])
+        consumer = asyncio.create_task(async_event_bus.run())
+        await async_event_bus.publish(sender=None, event="A")
+        await async_event_bus.join()
+        consumer.cancel()
+        assert async_event_bus.events_dispatched == 2
+
+    asyncio.run(run_async_event_bus())
+
+    failing_bus = EventBusMediator()
+    handled = []
+
+    def emit_then_fail(sender: object):
+        failing_bus.notify_mediator_of_event(sender=sender, event="later")
+        raise ValueError("handler failed")
+
+    failing_bus.add_route(event="X", handler=emit_then_fail, emits=["later"])
+    failing_bus.add_route(event="later", handler=lambda sender: handled.append("later"))
+    failing_bus.add_route(event="Y", handler=lambda sender: handled.append("Y"))
+    try:
+        failing_bus.notify_mediator_of_event(sender=None, event="X")
+    except ValueError:
+        pass
+    failing_bus.notify_mediator_of_event(sender=None, event="Y")
+    assert handled == ["Y"]
+
+    async def run_coroutine_handler():
+        async_event_bus = AsyncEventBusMediator(max_queue_size=1)
+
+        async def emit_after_await(sender: object):
+            await asyncio.sleep(0)
+            async_event_bus.notify_mediator_of_event(sender=sender, event="B")
+            async_event_bus.notify_mediator_of_event(sender=sender, event="B")
+
+        async_event_bus.add_route(event="A", handler=emit_after_await, emits=["B"])
+        consumer = asyncio.create_task(async_event_bus.run())
+        await async_event_bus.publish(sender=None, event="A")
+        await async_event_bus.join()
+        assert not consumer.done() and async_event_bus.events_dispatched == 3
+        consumer.cancel()
+
+    asyncio.run(run_coroutine_handler())
+
+    async def run_failing_handler():
+        errors = []
+        async_event_bus = AsyncEventBusMediator(on_error=lambda sender, event, error: errors.append((event, str(error))))
+
+        def fail(sender: object):
+            raise ValueError("handler failed")
+
+        async_event_bus.add_route(event="X", handler=fail)
+        async_event_bus.add_route(event="Y", handler=lambda sender: handled.append("async Y"))
+        consumer = asyncio.create_task(async_event_bus.run())
+        await async_event_bus.publish(sender=None, event="X")
+        await async_event_bus.publish(sender=None, event="Y")
+        await async_event_bus.join()
+        assert not consumer.done() and async_event_bus.cascades_failed == 1 and errors == [("X", "handler failed")]
+        assert handled[-1] == "async Y"
+        consumer.cancel()
+
+    asyncio.run(run_failing_handler())
+
+    shared_mediator = SharedMemoryMediator(number_of_processes=1, ring_capacity=64)
+    shared_mediator.add_route(event="A", slot=0, component_name="component 2", method_name="do_d")
+    shared_mediator.attach(slot=0)
+    shared_mediator.register(name="component 1", component=component_1)
+    shared_mediator.register(name="component 2", component=component_2)
+    component_1.do_a()
+    assert shared_mediator.poll() == 1
+    shared_mediator.close()
+
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
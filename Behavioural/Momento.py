@@ -6,26 +6,109 @@ from __future__ import annotations
 
 import copy
 import datetime
+import marshal
+import mmap
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import zlib
 from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional
+
+# Saved state is held as a persistent tree. The leaves are tuples of up to CHUNK_SIZE items of the state and every other node is a tuple of up to
+# CHUNK_SIZE children. A snapshot only builds new nodes on the path to the items that changed since the previous snapshot and shares every other node
+# with it, so saving after appending to a state of S items costs O(CHUNK_SIZE * log(S)) rather than O(S / CHUNK_SIZE)
+CHUNK_SIZE = 64
+
+
+def _build_node(state: [str], start: int, level: int) -> tuple:
+    if level == 0:
+        return tuple(state[start:start + CHUNK_SIZE])
+    child_span = CHUNK_SIZE ** level
+    stop = min(len(state), start + child_span * CHUNK_SIZE)
+    return tuple(_build_node(state, child_start, level - 1) for child_start in range(start, stop, child_span))
+
+
+def _update_node(node: tuple, state: [str], start: int, level: int, dirty_from: int) -> tuple:
+    # Children entirely before dirty_from are shared, the one holding dirty_from is updated and the ones after it are built from the state
+    if level == 0:
+        return tuple(state[start:start + CHUNK_SIZE])
+    child_span = CHUNK_SIZE ** level
+    stop = min(len(state), start + child_span * CHUNK_SIZE)
+    first_dirty_child = (dirty_from - start) // child_span
+    children = list(node[:first_dirty_child])
+    child_start = start + first_dirty_child * child_span
+    if first_dirty_child < len(node) and child_start < stop:
+        children.append(_update_node(node[first_dirty_child], state, child_start, level - 1, dirty_from))
+        child_start += child_span
+    children.extend(_build_node(state, next_start, level - 1) for next_start in range(child_start, stop, child_span))
+    return tuple(children)
+
+
+def _shared_prefix(node: tuple, other: tuple, start: int, level: int) -> int:
+    # The number of leading items (from start) held in nodes that both trees share
+    child_span = CHUNK_SIZE ** level
+    for index, (child, other_child) in enumerate(zip(node, other)):
+        if child is not other_child:
+            return start + index * child_span + (_shared_prefix(child, other_child, 0, level - 1) if level > 0 else 0)
+    return start + min(len(node), len(other)) * child_span
+
+
+def _extend_from(node: tuple, state: [str], start: int, level: int, from_index: int):
+    if level == 0:
+        state.extend(node[max(0, from_index - start):])
+        return
+    child_span = CHUNK_SIZE ** level
+    for index in range(max(0, (from_index - start) // child_span), len(node)):
+        _extend_from(node[index], state, start + index * child_span, level - 1, from_index)
 
 
 class ClassWithState:
-    __state: [str] = []
+
+    def __init__(self):
+        self.__state: [str] = []
+        # The tree (root and level) of the last saved or restored snapshot, and the first index of the state that has changed since then
+        self.__base_root: tuple = ()
+        self.__base_level = 0
+        self.__dirty_from = 0
 
     def print_current_state(self):
         print(self.__state)
 
     def modify_state(self):
         self.__state.append("Something new")
+        self.__dirty_from = min(self.__dirty_from, len(self.__state) - 1)
 
     def save(self) -> Momento:
-        return ConcreteMomento(name="ewq", date=datetime.date.today(), state=self.__state)
+        root, level = self.__base_root, self.__base_level
+        if self.__dirty_from < len(self.__state):
+            # The tree gets one level deeper whenever the state outgrows it, the old root becoming the first child of the new one
+            while CHUNK_SIZE ** (level + 1) < len(self.__state):
+                root, level = (root,), level + 1
+            root = _update_node(root, self.__state, 0, level, self.__dirty_from)
+        self.__base_root, self.__base_level = root, level
+        self.__dirty_from = len(self.__state)
+        return ConcreteMomento(name="ewq", date=datetime.date.today(), state=(root, level, len(self.__state)))
 
     def restore(self, momento: Momento):
         # Here we don't reference the concrete type of the momento here, the idea is that the conrete type is never referenced, and hence the internal state
         # of this class is never exposed
-        state = momento.get_internal_state()
-        self.__state = state
+        root, level, length = momento.get_internal_state()
+        # Only the part of the state after the first node that differs from what we currently hold has to be rebuilt
+        base_root = self.__base_root
+        for _ in range(level, self.__base_level):
+            base_root = base_root[0] if base_root else ()
+        target_root = root
+        for _ in range(self.__base_level, level):
+            target_root = target_root[0] if target_root else ()
+        common = min(_shared_prefix(target_root, base_root, 0, min(level, self.__base_level)), self.__dirty_from, length)
+        del self.__state[common:]
+        _extend_from(root, self.__state, 0, level, common)
+        self.__base_root, self.__base_level = root, level
+        self.__dirty_from = len(self.__state)
 
 
 # A memento saves the internal state of the class. However the interface doesn't show how the state is saved, only a concrete implementation does.
@@ -42,10 +125,11 @@ class Momento(ABC):
 
 class ConcreteMomento(Momento):
 
-    def __init__(self, name: str, date: datetime.date, state: [str]):
+    def __init__(self, name: str, date: datetime.date, state: (tuple, int, int)):
+        # The state is already immutable, so it can be held (and shared with other momentos) without copying it
         self.__name = name
         self.__date = date
-        self.__state = copy.deepcopy(state)
+        self.__state = state
 
     def get_date_momento_was_saved(self) -> datetime.date:
         return self.__date
@@ -53,14 +137,15 @@ class ConcreteMomento(Momento):
     def get_name(self) -> str:
         return self.__name
 
-    def get_internal_state(self) -> [str]:
+    def get_internal_state(self) -> (tuple, int, int):
         return self.__state
 
 
 class CareTaker:
-    __momentos: [Momento] = []
 
-    def __init__(self, originator: ClassWithState):
+    def __init__(self, originator: ClassWithState, max_history: int = 100):
+        # Once the history is full the oldest momento is dropped
+        self.__momentos: deque[Momento] = deque(maxlen=max_history)
         self.__originator = originator
 
     def save(self):
@@ -75,6 +160,180 @@ class CareTaker:
         self.__originator.restore(momento=last_momento)
 
 
+class MomentoLog:
+    """
+    Append only file of zlib compressed records, read back through a memory map. Records are buffered and written together once `group_commit_size`
+    of them are pending (or flush() is called), so the file is written to in a few large writes rather than one per record.
+
+    The log is scratch space for one session: the index of records lives in memory, so the file is truncated when it is opened rather than appended to.
+    Records are encoded with marshal, whose format is only guaranteed to be readable by the same Python version, which is fine for a log that never
+    outlives the process that wrote it.
+    """
+
+    def __init__(self, path: str, group_commit_size: int = 64):
+        self.__file = open(path, "w+b")
+        self.__size = 0
+        self.__pending: [bytes] = []
+        self.__pending_size = 0
+        self.__group_commit_size = group_commit_size
+        self.__map: Optional[mmap.mmap] = None
+
+    def append(self, record) -> (int, int):
+        data = zlib.compress(marshal.dumps(record))
+        offset = self.__size + self.__pending_size
+        self.__pending.append(data)
+        self.__pending_size += len(data)
+        if len(self.__pending) >= self.__group_commit_size:
+            self.flush()
+        return offset, len(data)
+
+    def read(self, offset: int, length: int):
+        if offset + length > self.__size:
+            self.flush()
+        if self.__map is None or len(self.__map) < offset + length:
+            # The file has grown since it was last mapped
+            if self.__map is not None:
+                self.__map.close()
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        return marshal.loads(zlib.decompress(self.__map[offset:offset + length]))
+
+    def flush(self):
+        if not self.__pending:
+            return
+        self.__file.write(b"".join(self.__pending))
+        self.__file.flush()
+        self.__size += self.__pending_size
+        self.__pending = []
+        self.__pending_size = 0
+
+    def close(self):
+        self.flush()
+        if self.__map is not None:
+            self.__map.close()
+        self.__file.close()
+
+
+class DiskMomento(Momento):
+
+    def __init__(self, name: str, date: datetime.date, log: MomentoLog, offset: int, length: int):
+        self.__name = name
+        self.__date = date
+        self.__log = log
+        self.__offset = offset
+        self.__length = length
+
+    def get_date_momento_was_saved(self) -> datetime.date:
+        return self.__date
+
+    def get_name(self) -> str:
+        return self.__name
+
+    def get_internal_state(self) -> (tuple, int, int):
+        root_location, level, length = self.__log.read(self.__offset, self.__length)
+        return self.__read_node(root_location, level), level, length
+
+    def __read_node(self, location: (int, int), level: int) -> tuple:
+        record = self.__log.read(*location)
+        if level == 0:
+            return tuple(record)
+        return tuple(self.__read_node(child_location, level - 1) for child_location in record)
+
+
+class DiskCareTaker:
+    """
+    Keeps the history on disk rather than in memory. Only the (offset, length) of each momento is held in memory. On disk a momento is the location
+    of its root node, a node is a list of the locations of its children, and a node is only written once for as long as consecutive momentos keep
+    sharing it. Like the in memory CareTaker the history only lasts as long as the caretaker, any log already at `path` is overwritten.
+    """
+
+    def __init__(self, originator: ClassWithState, path: str, group_commit_size: int = 64):
+        self.__originator = originator
+        self.__log = MomentoLog(path=path, group_commit_size=group_commit_size)
+        self.__momentos: [DiskMomento] = []
+        # The tree of the previous momento as (node, location, children) with its level
+        self.__previous_written: Optional[(tuple, (int, int), tuple)] = None
+        self.__previous_level = 0
+
+    def __write_node(self, node: tuple, level: int, previous: Optional[(tuple, (int, int), tuple)]) -> (tuple, (int, int), tuple):
+        if previous is not None and previous[0] is node:
+            return previous
+        if level == 0:
+            return node, self.__log.append(node), ()
+        previous_children = previous[2] if previous is not None else ()
+        children = tuple(self.__write_node(child, level - 1, previous_children[index] if index < len(previous_children) else None)
+                         for index, child in enumerate(node))
+        return node, self.__log.append([child[1] for child in children]), children
+
+    def save(self):
+        momento = self.__originator.save()
+        root, level, length = momento.get_internal_state()
+        # Line the previous tree up with this one when the tree has changed depth since
+        previous = self.__previous_written
+        for _ in range(level, self.__previous_level):
+            previous = previous[2][0] if previous is not None and previous[2] else None
+        for _ in range(self.__previous_level, level):
+            previous = (None, None, (previous,)) if previous is not None else None
+        written = self.__write_node(root, level, previous)
+        self.__previous_written, self.__previous_level = written, level
+
+        offset, record_length = self.__log.append((written[1], level, length))
+        self.__momentos.append(DiskMomento(name=momento.get_name(), date=momento.get_date_momento_was_saved(), log=self.__log, offset=offset,
+                                           length=record_length))
+
+    def undo(self):
+        if len(self.__momentos) == 0:
+            return
+
+        last_momento = self.__momentos.pop()
+        self.__originator.restore(momento=last_momento)
+
+    def flush(self):
+        self.__log.flush()
+
+    def close(self):
+        self.__log.close()
+
+
+def benchmark(number_of_saves: int = 10_000, state_size: int = 10_000):
+    originator = ClassWithState()
+    for _ in range(state_size):
+        originator.modify_state()
+    caretaker = CareTaker(originator=originator, max_history=number_of_saves)
+
+    tracemalloc.start()
+    for _ in range(number_of_saves):
+        originator.modify_state()
+        caretaker.save()
+    shared_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    state = ["Something new"] * state_size
+    copies = []
+    tracemalloc.start()
+    for _ in range(number_of_saves // 10):
+        state.append("Something new")
+        copies.append(copy.deepcopy(state))
+    deepcopy_memory = tracemalloc.get_traced_memory()[0] * 10
+    tracemalloc.stop()
+
+    print(f"{number_of_saves} saves of a {state_size} item state: shared tree {shared_memory / 2 ** 20:.1f}MiB, "
+          f"deepcopy {deepcopy_memory / 2 ** 20:.1f}MiB (extrapolated from {number_of_saves // 10} saves)")
+
+    # The cost of a save after an append should barely grow with the size of the state
+    for large_state_size in (10_000, 1_000_000):
+        originator = ClassWithState()
+        for _ in range(large_state_size):
+            originator.modify_state()
+        originator.save()
+
+        def save_after_append():
+            originator.modify_state()
+            originator.save()
+
+        save_time = min(timeit.repeat(save_after_append, number=1000, repeat=3)) / 1000
+        print(f"save after an append to a {large_state_size} item state: {save_time * 1e6:.1f}us")
+
+
 def main():
     originator = ClassWithState()
     caretaker = CareTaker(originator=originator)
@@ -97,6 +356,19 @@ def main():
     caretaker.undo()
     originator.print_current_state()
 
+    with tempfile.TemporaryDirectory() as directory:
+        disk_caretaker = DiskCareTaker(originator=originator, path=os.path.join(directory, "momentos.log"), group_commit_size=2)
+        for _ in range(3):
+            originator.modify_state()
+            disk_caretaker.save()
+        disk_caretaker.undo()
+        disk_caretaker.undo()
+        originator.print_current_state()
+        disk_caretaker.close()
+
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
@@ -8,7 +8,15 @@ Words:
     Observer -> The class that wants to be notified
 """
 from __future__ import annotations
+
+import asyncio
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Optional
 
 
 class Observer(ABC):
@@ -34,17 +42,127 @@ class Subject(ABC):
 
 
 class ConcreteSubject(Subject):
-    __observers: [Observer] = []
+    """
+    Observers are held weakly, so a subject never keeps an observer alive, and removing one is O(1).
+
+    Given an executor, every observer is updated as its own task on that executor, so one slow observer doesn't hold up the others.
+    notify_all_observers() then returns the futures rather than waiting on them.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None):
+        self.__observers: weakref.WeakSet[Observer] = weakref.WeakSet()
+        self.__executor = executor
 
     def remove(self, observer: Observer):
-        self.__observers.remove(observer)
+        self.__observers.discard(observer)
 
     def add(self, observer: Observer):
-        self.__observers.append(observer)
-
-    def notify_all_observers(self):
-        for observer in self.__observers:
-            observer.update(updated_value_or_subject=self)
+        self.__observers.add(observer)
+
+    def __len__(self) -> int:
+        return len(self.__observers)
+
+    def notify_all_observers(self) -> [Future]:
+        return self._notify_observers(updated_subject_or_value=self)
+
+    def _notify_observers(self, updated_subject_or_value: Any) -> [Future]:
+        # Copy first, observers may be garbage collected or removed while we notify
+        observers = list(self.__observers)
+        if self.__executor is None:
+            for observer in observers:
+                observer.update(updated_subject_or_value=updated_subject_or_value)
+            return []
+
+        return [self.__executor.submit(observer.update, updated_subject_or_value=updated_subject_or_value) for observer in observers]
+
+    async def notify_all_observers_async(self) -> [Optional[BaseException]]:
+        # Runs each update on the executor (the loop's default one if none was given) and waits for all of them. An observer raising doesn't stop the
+        # others, its exception is returned in its place
+        loop = asyncio.get_running_loop()
+        observers = list(self.__observers)
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.__executor, lambda observer=observer: observer.update(updated_subject_or_value=self)) for observer in observers),
+            return_exceptions=True,
+        )
+        return [result if isinstance(result, BaseException) else None for result in results]
+
+
+class CoalescingSubject(ConcreteSubject):
+    """
+    Collapses bursts of changes into one notification. Outside of a transaction, changes made with set_value() are held back until either `max_delay`
+    seconds have passed since the first pending change or `max_batch_size` changes are pending. Inside a transaction() neither limit applies, every
+    change, including ones pending from before it started, is held back until the outermost transaction ends. Observers then get a single update whose
+    value is the net change, a dict of every changed key to its latest value.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, max_delay: float = 0.05, max_batch_size: int = 1000):
+        super().__init__(executor=executor)
+        if max_delay < 0 or max_batch_size < 1:
+            raise ValueError("max_delay can't be negative and max_batch_size must be at least 1")
+        self.__max_delay = max_delay
+        self.__max_batch_size = max_batch_size
+        self.__values: {str: Any} = {}
+        self.__pending_changes: {str: Any} = {}
+        self.__pending_change_count = 0
+        self.__transaction_depth = 0
+        self.__timer: Optional[threading.Timer] = None
+        self.__lock = threading.RLock()
+        self.notifications_sent = 0
+        self.notifications_suppressed = 0
+
+    def get_value(self, key: str) -> Any:
+        return self.__values.get(key)
+
+    def set_value(self, key: str, value: Any):
+        with self.__lock:
+            self.__values[key] = value
+            self.__pending_changes[key] = value
+            self.__pending_change_count += 1
+            if self.__transaction_depth > 0:
+                return
+            flush_now = self.__pending_change_count >= self.__max_batch_size or self.__max_delay == 0
+            if not flush_now and self.__timer is None:
+                self.__timer = threading.Timer(self.__max_delay, self.__flush_when_due)
+                self.__timer.daemon = True
+                self.__timer.start()
+        # Observers are notified outside of the lock
+        if flush_now:
+            self.flush()
+
+    @contextmanager
+    def transaction(self):
+        with self.__lock:
+            self.__transaction_depth += 1
+        try:
+            yield self
+        finally:
+            with self.__lock:
+                self.__transaction_depth -= 1
+                transaction_ended = self.__transaction_depth == 0
+            if transaction_ended:
+                self.flush()
+
+    def __flush_when_due(self):
+        with self.__lock:
+            if self.__transaction_depth > 0:
+                # A transaction started after the timer did, its end flushes the changes pending from before it too
+                self.__timer = None
+                return
+        self.flush()
+
+    def flush(self) -> [Future]:
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if not self.__pending_changes:
+                return []
+            net_change = self.__pending_changes
+            self.notifications_sent += 1
+            self.notifications_suppressed += self.__pending_change_count - 1
+            self.__pending_changes = {}
+            self.__pending_change_count = 0
+        return self._notify_observers(updated_subject_or_value=net_change)
 
 
 class ConcreteObserver(Observer):
@@ -52,3 +170,44 @@ class ConcreteObserver(Observer):
     def update(self, updated_subject_or_value: Subject):
         # do something with updated value - implementation omitted
         pass
+
+
+def main():
+    subject = ConcreteSubject()
+    observer_1 = ConcreteObserver()
+    observer_2 = ConcreteObserver()
+    subject.add(observer=observer_1)
+    subject.add(observer=observer_2)
+    subject.notify_all_observers()
+
+    subject.remove(observer=observer_1)
+    del observer_2
+    assert len(subject) == 0
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        concurrent_subject = ConcreteSubject(executor=executor)
+        observers = [ConcreteObserver() for _ in range(1000)]
+        for observer in observers:
+            concurrent_subject.add(observer=observer)
+        for future in concurrent_subject.notify_all_observers():
+            future.result()
+        assert asyncio.run(concurrent_subject.notify_all_observers_async()) == [None] * 1000
+
+    coalescing_subject = CoalescingSubject(max_delay=0.01, max_batch_size=100)
+    coalescing_subject.add(observer=observer_1)
+    with coalescing_subject.transaction():
+        for bid in range(250):
+            coalescing_subject.set_value(key="highest bid", value=bid)
+    assert (coalescing_subject.notifications_sent, coalescing_subject.notifications_suppressed) == (1, 249)
+
+    coalescing_subject.set_value(key="a", value=0)
+    with coalescing_subject.transaction():
+        coalescing_subject.set_value(key="b", value=1)
+        # Past max_delay of the change made before the transaction, which must still wait for the transaction
+        time.sleep(0.05)
+        coalescing_subject.set_value(key="c", value=2)
+    assert (coalescing_subject.notifications_sent, coalescing_subject.notifications_suppressed) == (2, 251)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,39 +11,51 @@ Words:
 """
 from __future__ import annotations
 
+import contextlib
+import operator
+import os
+import sys
+import time
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Iterable, Optional
+
+try:
+    import numpy
+except ImportError:
+    # Optional, only used to apply events to scattered batches of trackers in one step
+    numpy = None
 
 
 class Context(ABC):
 
     @abstractmethod
-    def transition_to_state(self, state: TrackerStateInterface):
+    def transition_to_state(self, state: TrackerStateInterface, event: Optional[str] = None):
         pass
 
 
 class TrackerStateInterface(ABC):
+    """
+    States hold no data of their own, the context they act on is passed in. So one instance of each state is shared by every tracker, and a transition
+    is just swapping which instance the tracker points at.
+    """
 
     @abstractmethod
-    def start_tracker(self):
+    def start_tracker(self, context: Context):
         pass
 
     @abstractmethod
-    def pause_tracker(self):
+    def pause_tracker(self, context: Context):
         pass
 
 
 class EnabledLocationTrackerState(TrackerStateInterface):
 
-    def __init__(self, context: Context):
-        self._context = context
-
-    def pause_tracker(self):
+    def pause_tracker(self, context: Context):
         # Do some stuff related to pausing...
         print("pause in enabled tracker")
-        self._context.transition_to_state(state=DisabledLocationTrackerState(context=self._context))
+        context.transition_to_state(state=DISABLED_LOCATION_TRACKER_STATE, event="pause_tracker")
 
-    def start_tracker(self):
+    def start_tracker(self, context: Context):
         # Do some stuff related to starting...
         print("start in enabled tracker")
         pass
@@ -51,42 +63,287 @@ class EnabledLocationTrackerState(TrackerStateInterface):
 
 class DisabledLocationTrackerState(TrackerStateInterface):
 
-    def __init__(self, context: Context):
-        self._context = context
-
-    def pause_tracker(self):
+    def pause_tracker(self, context: Context):
         # Do some stuff related to pausing...
         print("pause in disabled tracker")
         pass
 
-    def start_tracker(self):
+    def start_tracker(self, context: Context):
         # Do some stuff related to starting...
         print("start in disabled tracker")
-        self._context.transition_to_state(state=EnabledLocationTrackerState(context=self._context))
+        context.transition_to_state(state=ENABLED_LOCATION_TRACKER_STATE, event="start_tracking")
+
+
+ENABLED_LOCATION_TRACKER_STATE = EnabledLocationTrackerState()
+DISABLED_LOCATION_TRACKER_STATE = DisabledLocationTrackerState()
+
+
+class TransitionTrace:
+    """
+    Keeps the last `size` transitions as (timestamp in ns, from state, to state, event). The slots are allocated up front and overwritten in a ring, so
+    recording a transition is a few list assignments, with no allocation and no logging.
+    """
+
+    def __init__(self, size: int = 4096):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.__size = size
+        self.__timestamps = [0] * size
+        self.__from_states: [Optional[TrackerStateInterface]] = [None] * size
+        self.__to_states: [Optional[TrackerStateInterface]] = [None] * size
+        self.__events: [Optional[str]] = [None] * size
+        self.__recorded = 0
+
+    def record(self, from_state: TrackerStateInterface, to_state: TrackerStateInterface, event: Optional[str]):
+        index = self.__recorded % self.__size
+        self.__timestamps[index] = time.perf_counter_ns()
+        self.__from_states[index] = from_state
+        self.__to_states[index] = to_state
+        self.__events[index] = event
+        self.__recorded += 1
+
+    def __len__(self) -> int:
+        return min(self.__recorded, self.__size)
+
+    def entries(self) -> [(int, TrackerStateInterface, TrackerStateInterface, Optional[str])]:
+        # Oldest first
+        first = self.__recorded - len(self)
+        return [(self.__timestamps[index % self.__size], self.__from_states[index % self.__size], self.__to_states[index % self.__size],
+                 self.__events[index % self.__size]) for index in range(first, self.__recorded)]
+
+    def counts(self) -> {(str, str, Optional[str]): int}:
+        # How often each (from state, to state, event) transition appears in the trace, to find the hot ones
+        counts = {}
+        for _, from_state, to_state, event in self.entries():
+            key = (type(from_state).__name__, type(to_state).__name__, event)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
 
 
 class LocationTracker(Context):
 
-    def __init__(self):
-        self.__state: TrackerStateInterface = EnabledLocationTrackerState(context=self)
-        self.__state.context = self
+    def __init__(self, trace: Optional[TransitionTrace] = None):
+        self.__state: TrackerStateInterface = ENABLED_LOCATION_TRACKER_STATE
+        # Several trackers can share one trace
+        self.__trace = trace
 
     def start_tracking(self):
-        self.__state.start_tracker()
+        self.__state.start_tracker(context=self)
 
     def pause_tracker(self):
-        self.__state.pause_tracker()
+        self.__state.pause_tracker(context=self)
 
-    def transition_to_state(self, state: TrackerStateInterface):
+    def transition_to_state(self, state: TrackerStateInterface, event: Optional[str] = None):
+        if self.__trace is not None:
+            self.__trace.record(from_state=self.__state, to_state=state, event=event)
         self.__state = state
 
 
+class StateMachine:
+    """
+    States and transitions declared once as names and compiled into tables. States become small ints and each event becomes a 256 byte table mapping
+    every state to the state the event moves it to, so a whole array of states can be moved in one bytes.translate() call. Events a state has no
+    transition for leave it as it is.
+    """
+
+    def __init__(self, states: [str], initial_state: str, transitions: {(str, str): str}):
+        if len(states) > 256:
+            raise ValueError("a state machine can have at most 256 states")
+        self.states = list(states)
+        self.state_ids = {state: state_id for state_id, state in enumerate(self.states)}
+        self.initial_state_id = self.state_ids[initial_state]
+        self.transition_tables: {str: bytes} = {}
+        for (from_state, event), to_state in transitions.items():
+            table = bytearray(self.transition_tables.get(event, bytes(range(256))))
+            table[self.state_ids[from_state]] = self.state_ids[to_state]
+            self.transition_tables[event] = bytes(table)
+
+
+LOCATION_TRACKER_STATE_MACHINE = StateMachine(
+    states=["enabled", "disabled"],
+    initial_state="enabled",
+    transitions={("enabled", "pause_tracker"): "disabled", ("disabled", "start_tracking"): "enabled"},
+)
+
+
+class LocationTrackerFleet:
+    """
+    The state of many trackers, one byte per tracker. An event is applied to the whole fleet, or to a batch of trackers given as a range of ids
+    (including ranges with a step, e.g. every other tracker), in one vectorized step. Any other collection of ids is gathered and scattered in one
+    step with NumPy fancy indexing when NumPy is installed, a NumPy array of ids avoids even converting them. Without NumPy they are applied with one
+    step per run of consecutive ids, so a scattered batch costs a Python operation per id.
+
+    Tracker ids must be integers between 0 and len(fleet) - 1, anything else raises IndexError.
+    """
+
+    def __init__(self, number_of_trackers: int = 0, state_machine: StateMachine = LOCATION_TRACKER_STATE_MACHINE):
+        self.__state_machine = state_machine
+        self.__states = bytearray([state_machine.initial_state_id]) * number_of_trackers
+
+    def __len__(self) -> int:
+        return len(self.__states)
+
+    def add_trackers(self, number_of_trackers: int) -> range:
+        first_id = len(self.__states)
+        self.__states += bytes([self.__state_machine.initial_state_id]) * number_of_trackers
+        return range(first_id, len(self.__states))
+
+    def apply(self, event: str, tracker_ids: Optional[Iterable[int]] = None):
+        table = self.__state_machine.transition_tables.get(event)
+        if table is None:
+            raise ValueError(f"unknown event {event}")
+        states = self.__states
+        if tracker_ids is None:
+            states[:] = states.translate(table)
+            return
+        if isinstance(tracker_ids, range):
+            if not tracker_ids:
+                return
+            if tracker_ids.step < 0:
+                tracker_ids = tracker_ids[::-1]
+            self.__check_ids(lowest=tracker_ids[0], highest=tracker_ids[-1])
+            selected = slice(tracker_ids.start, tracker_ids[-1] + 1, tracker_ids.step)
+            states[selected] = states[selected].translate(table)
+            return
+
+        if numpy is not None:
+            self.__apply_gathered(table=table, tracker_ids=tracker_ids)
+            return
+
+        # Split the ids into runs of consecutive ids, each run is translated as one slice
+        try:
+            sorted_ids = sorted(set(map(operator.index, tracker_ids)))
+        except TypeError:
+            raise IndexError("tracker ids must be integers") from None
+        if not sorted_ids:
+            return
+        self.__check_ids(lowest=sorted_ids[0], highest=sorted_ids[-1])
+        run_start = 0
+        for index in range(1, len(sorted_ids) + 1):
+            if index == len(sorted_ids) or sorted_ids[index] != sorted_ids[index - 1] + 1:
+                start, stop = sorted_ids[run_start], sorted_ids[index - 1] + 1
+                if stop - start == 1:
+                    states[start] = table[states[start]]
+                else:
+                    states[start:stop] = states[start:stop].translate(table)
+                run_start = index
+
+    def __apply_gathered(self, table: bytes, tracker_ids: Iterable[int]):
+        if isinstance(tracker_ids, numpy.ndarray):
+            if tracker_ids.dtype.kind not in "iu":
+                raise IndexError("tracker ids must be integers")
+            ids = tracker_ids.ravel()
+        else:
+            try:
+                ids = numpy.fromiter(map(operator.index, tracker_ids), dtype=numpy.intp)
+            except TypeError:
+                raise IndexError("tracker ids must be integers") from None
+        if not len(ids):
+            return
+        self.__check_ids(lowest=int(ids.min()), highest=int(ids.max()))
+        # The view is dropped again before returning, the fleet's bytearray can't grow while a view of it exists
+        states = numpy.frombuffer(self.__states, dtype=numpy.uint8)
+        states[ids] = numpy.frombuffer(table, dtype=numpy.uint8)[states[ids]]
+        del states
+
+    def __check_ids(self, lowest: int, highest: int):
+        if lowest < 0 or highest >= len(self.__states):
+            raise IndexError(f"tracker ids must be between 0 and {len(self.__states) - 1}")
+
+    def state_of(self, tracker_id: int) -> str:
+        try:
+            tracker_id = operator.index(tracker_id)
+        except TypeError:
+            raise IndexError("tracker ids must be integers") from None
+        self.__check_ids(lowest=tracker_id, highest=tracker_id)
+        return self.__state_machine.states[self.__states[tracker_id]]
+
+    def count(self, state: str) -> int:
+        return self.__states.count(self.__state_machine.state_ids[state])
+
+    def tracker(self, tracker_id: int) -> LocationTrackerView:
+        return LocationTrackerView(fleet=self, tracker_id=tracker_id)
+
+
+class LocationTrackerView:
+    # The single tracker API on top of one entry of a fleet
+
+    def __init__(self, fleet: LocationTrackerFleet, tracker_id: int):
+        self.__fleet = fleet
+        self.__tracker_id = tracker_id
+
+    def start_tracking(self):
+        self.__fleet.apply(event="start_tracking", tracker_ids=range(self.__tracker_id, self.__tracker_id + 1))
+
+    def pause_tracker(self):
+        self.__fleet.apply(event="pause_tracker", tracker_ids=range(self.__tracker_id, self.__tracker_id + 1))
+
+    @property
+    def state(self) -> str:
+        return self.__fleet.state_of(tracker_id=self.__tracker_id)
+
+
+def benchmark(number_of_trackers: int = 1_000_000):
+    # The trackers print on every transition, that output is thrown away
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started_at = time.perf_counter()
+        trackers = [LocationTracker() for _ in range(number_of_trackers // 10)]
+        for tracker in trackers:
+            tracker.pause_tracker()
+        object_time = (time.perf_counter() - started_at) * 10
+
+    fleet = LocationTrackerFleet(number_of_trackers=number_of_trackers)
+    started_at = time.perf_counter()
+    fleet.apply(event="pause_tracker")
+    fleet_time = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    fleet.apply(event="start_tracking", tracker_ids=range(0, number_of_trackers, 2))
+    batch_time = time.perf_counter() - started_at
+    scattered_ids = list(range(1, number_of_trackers, 2))
+    started_at = time.perf_counter()
+    fleet.apply(event="start_tracking", tracker_ids=scattered_ids)
+    scattered_time = time.perf_counter() - started_at
+    scattered_method = "NumPy fancy indexing" if numpy is not None else "one step per id"
+    print(f"{number_of_trackers} trackers: objects {object_time:.2f}s (extrapolated), fleet {fleet_time * 1e3:.2f}ms, "
+          f"every other tracker as a range {batch_time * 1e3:.2f}ms, every other tracker as a list ({scattered_method}) {scattered_time * 1e3:.0f}ms")
+
+
 def main():
     tracker = LocationTracker()
     tracker.start_tracking()
     tracker.pause_tracker()
     tracker.start_tracking()
 
+    trace = TransitionTrace(size=2)
+    traced_tracker = LocationTracker(trace=trace)
+    traced_tracker.pause_tracker()
+    traced_tracker.start_tracking()
+    traced_tracker.pause_tracker()
+    assert [event for _, _, _, event in trace.entries()] == ["start_tracking", "pause_tracker"]
+    print(trace.counts())
+
+    fleet = LocationTrackerFleet(number_of_trackers=5)
+    fleet.apply(event="pause_tracker")
+    fleet.apply(event="start_tracking", tracker_ids=[0, 1, 3])
+    assert [fleet.state_of(tracker_id=tracker_id) for tracker_id in range(5)] == ["enabled", "enabled", "disabled", "enabled", "disabled"]
+    fleet_tracker = fleet.tracker(tracker_id=2)
+    fleet_tracker.start_tracking()
+    assert fleet_tracker.state == "enabled" and fleet.count(state="enabled") == 4
+
+    fleet.apply(event="pause_tracker")
+    fleet.apply(event="start_tracking", tracker_ids=range(4, -1, -2))
+    assert [fleet.state_of(tracker_id=tracker_id) for tracker_id in range(5)] == ["enabled", "disabled", "enabled", "disabled", "enabled"]
+    for tracker_ids in ([3, 4, 5, 6], [-1, 0], [5], range(3, 6), range(-1, 2), [0, 1.5], ["0"]):
+        try:
+            fleet.apply(event="pause_tracker", tracker_ids=tracker_ids)
+            raise AssertionError(f"{tracker_ids} should have been rejected")
+        except IndexError:
+            pass
+    assert fleet.count(state="enabled") == 3
+
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
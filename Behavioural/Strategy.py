@@ -9,6 +9,7 @@ Words:
     Strategy -> A concrete implementation of a "Strategy Interface"
     Context -> Some class/function/etc... that requires a "Strategy"
 """
+import time
 from abc import ABC, abstractmethod
 from typing import List
 
@@ -36,6 +37,73 @@ class Context:
         return self.__strategy.do_algorithm(data=data)
 
 
+class _StrategyTiming:
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        # Weighted towards recent calls, so the choice follows the data as it changes
+        self.recent_average_time = 0.0
+
+
+class AdaptiveContext:
+    """
+    Given several strategies implementing the same algorithm, routes each call to the one that has been fastest so far for inputs of a similar size.
+    Inputs are bucketed by the power of two their length falls in. Every strategy is first tried `warmup_calls` times per bucket, and after that every
+    `explore_every`th call in a bucket goes to the next strategy in turn, so a strategy that has become faster gets noticed.
+    """
+
+    def __init__(self, strategies: List[StrategyInterface], warmup_calls: int = 5, explore_every: int = 100, smoothing: float = 0.1):
+        if not strategies:
+            raise ValueError("at least one strategy is needed")
+        self.__strategies = strategies
+        self.__warmup_calls = warmup_calls
+        self.__explore_every = explore_every
+        self.__smoothing = smoothing
+        # bucket -> one timing per strategy
+        self.__timings: {int: List[_StrategyTiming]} = {}
+        self.__bucket_calls: {int: int} = {}
+
+    def __choose(self, timings: List[_StrategyTiming], bucket_calls: int) -> int:
+        for index, timing in enumerate(timings):
+            if timing.calls < self.__warmup_calls:
+                return index
+        if bucket_calls % self.__explore_every == 0:
+            return (bucket_calls // self.__explore_every) % len(timings)
+        return min(range(len(timings)), key=lambda index: timings[index].recent_average_time)
+
+    def run(self, data: str) -> int:
+        bucket = len(data).bit_length()
+        timings = self.__timings.get(bucket)
+        if timings is None:
+            timings = self.__timings[bucket] = [_StrategyTiming() for _ in self.__strategies]
+        bucket_calls = self.__bucket_calls.get(bucket, 0) + 1
+        self.__bucket_calls[bucket] = bucket_calls
+
+        index = self.__choose(timings=timings, bucket_calls=bucket_calls)
+        started_at = time.perf_counter()
+        result = self.__strategies[index].do_algorithm(data=data)
+        elapsed = time.perf_counter() - started_at
+
+        timing = timings[index]
+        timing.calls += 1
+        timing.total_time += elapsed
+        if timing.calls == 1:
+            timing.recent_average_time = elapsed
+        else:
+            timing.recent_average_time += self.__smoothing * (elapsed - timing.recent_average_time)
+        return result
+
+    def statistics(self) -> {StrategyInterface: {int: (int, float, float)}}:
+        # strategy -> input size bucket -> (calls, average time, recent average time). Bucket n holds inputs of length 2 ** (n - 1) to 2 ** n - 1
+        statistics = {}
+        for bucket, timings in sorted(self.__timings.items()):
+            for strategy, timing in zip(self.__strategies, timings):
+                if timing.calls:
+                    statistics.setdefault(strategy, {})[bucket] = (timing.calls, timing.total_time / timing.calls, timing.recent_average_time)
+        return statistics
+
+
 class ExampleStrategy1(StrategyInterface):
 
     def do_algorithm(self, data: str) -> int:
@@ -56,5 +124,11 @@ def main():
     output = context.run(data="0")
     assert output == 0
 
+    adaptive_context = AdaptiveContext(strategies=[ExampleStrategy1(), ExampleStrategy1()])
+    for data in ("1", "12", "123456789") * 20:
+        assert adaptive_context.run(data=data) == int(data)
+    statistics = adaptive_context.statistics()
+    assert sum(calls for buckets in statistics.values() for calls, _, _ in buckets.values()) == 60
+
 if __name__ == "__main__":
     main()
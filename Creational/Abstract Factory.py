@@ -7,7 +7,11 @@ Example: You have an abstract factory called "Document Creator". You want to be
 create return a FancyResume and a FancyCoverLetter, whereas another might create a ModernResume, and ModernCoverLetter. You can see that each factory groups
 the classes as they are compabtilbe with each other
 """
+import gc
+import sys
+import time
 from abc import ABC, abstractmethod
+from typing import Union
 
 
 class CoverLetter(ABC):
@@ -16,6 +20,10 @@ class CoverLetter(ABC):
     def do_something(self):
         pass
 
+    def reset(self):
+        # Called before a pooled cover letter is handed out again, implementations clear any state left by the previous user
+        pass
+
 
 class Resume(ABC):
 
@@ -23,6 +31,10 @@ class Resume(ABC):
     def do_something(self):
         pass
 
+    def reset(self):
+        # Called before a pooled resume is handed out again, implementations clear any state left by the previous user
+        pass
+
 
 class DocumentCreatorAbstractFactory(ABC):
 
@@ -71,6 +83,65 @@ class ModernDocumentCreator(DocumentCreatorAbstractFactory):
         return ModernCoverLetter()
 
 
+class PooledDocumentCreator(DocumentCreatorAbstractFactory):
+    """
+    Wraps another factory and recycles the documents it creates. Documents given back with release() are reset and handed out again by the next
+    create_* call instead of creating new ones. At most `max_pool_size` documents of each kind are kept, any more given back are left to be garbage
+    collected.
+
+    release() raises a ValueError for a document that is already back in the pool, and a TypeError for anything that is neither a Resume nor a
+    CoverLetter.
+    """
+
+    def __init__(self, factory: DocumentCreatorAbstractFactory, max_pool_size: int = 64):
+        self.__factory = factory
+        self.__max_pool_size = max_pool_size
+        self.__resumes: [Resume] = []
+        self.__cover_letters: [CoverLetter] = []
+        # Which pool each concrete document type goes back to, so the isinstance check is done once per type
+        self.__pools_by_type: {type: list} = {}
+        # The documents sitting in the pools, to catch a document being given back twice. Documents keep object's identity based hash and equality, so
+        # this is a set of the documents themselves rather than of their id(), which would allocate an int on every call
+        self.__pooled: {Union[Resume, CoverLetter]} = set()
+
+    # list.pop(), list.append() and the set operations are atomic, so the pools need no lock of their own. Under a race a pool may briefly hold a
+    # document or two more than max_pool_size, which is harmless
+
+    def create_resume(self) -> Resume:
+        try:
+            resume = self.__resumes.pop()
+        except IndexError:
+            return self.__factory.create_resume()
+        self.__pooled.discard(resume)
+        return resume
+
+    def create_cover_letter(self) -> CoverLetter:
+        try:
+            cover_letter = self.__cover_letters.pop()
+        except IndexError:
+            return self.__factory.create_cover_letter()
+        self.__pooled.discard(cover_letter)
+        return cover_letter
+
+    def release(self, document: Union[Resume, CoverLetter]):
+        # The document must not be used by the caller after giving it back
+        pool = self.__pools_by_type.get(type(document))
+        if pool is None:
+            if isinstance(document, Resume):
+                pool = self.__resumes
+            elif isinstance(document, CoverLetter):
+                pool = self.__cover_letters
+            else:
+                raise TypeError(f"can only release a Resume or a CoverLetter, not {type(document).__name__}")
+            self.__pools_by_type[type(document)] = pool
+        if document in self.__pooled:
+            raise ValueError("document has already been released")
+        document.reset()
+        if len(pool) < self.__max_pool_size:
+            self.__pooled.add(document)
+            pool.append(document)
+
+
 def client(factory: DocumentCreatorAbstractFactory):
     resume = factory.create_resume()
     cover_letter = factory.create_cover_letter()
@@ -79,6 +150,91 @@ def client(factory: DocumentCreatorAbstractFactory):
     cover_letter.do_something()
 
 
+class _DetailedResume(Resume):
+    # A resume with some state, unlike the examples above, so that creating one allocates objects the garbage collector tracks
+
+    def __init__(self):
+        self.sections: {str: [str]} = {"experience": [], "education": []}
+
+    def do_something(self):
+        self.sections["experience"].append("something")
+
+    def reset(self):
+        for lines in self.sections.values():
+            lines.clear()
+
+
+class _DetailedCoverLetter(CoverLetter):
+
+    def __init__(self):
+        self.paragraphs: [str] = []
+
+    def do_something(self):
+        self.paragraphs.append("something")
+
+    def reset(self):
+        self.paragraphs.clear()
+
+
+class _DetailedDocumentCreator(DocumentCreatorAbstractFactory):
+    def create_resume(self) -> Resume:
+        return _DetailedResume()
+
+    def create_cover_letter(self) -> CoverLetter:
+        return _DetailedCoverLetter()
+
+
+def benchmark(iterations: int = 1_000_000):
+    pauses: [float] = []
+    started_at = [0.0]
+
+    def time_collections(phase: str, info: dict):
+        if phase == "start":
+            started_at[0] = time.perf_counter()
+        else:
+            pauses.append(time.perf_counter() - started_at[0])
+
+    def create_and_discard(factory: DocumentCreatorAbstractFactory):
+        # Keeps some documents alive for a while, as a real workload would, so the collector has survivors to trace
+        recent = []
+        for _ in range(iterations):
+            resume = factory.create_resume()
+            cover_letter = factory.create_cover_letter()
+            resume.do_something()
+            cover_letter.do_something()
+            recent.append((resume, cover_letter))
+            if len(recent) == 32:
+                recent.clear()
+
+    def create_and_release(factory: PooledDocumentCreator):
+        recent = []
+        for _ in range(iterations):
+            resume = factory.create_resume()
+            cover_letter = factory.create_cover_letter()
+            resume.do_something()
+            cover_letter.do_something()
+            recent.append((resume, cover_letter))
+            if len(recent) == 32:
+                for resume, cover_letter in recent:
+                    factory.release(document=resume)
+                    factory.release(document=cover_letter)
+                recent.clear()
+
+    gc.callbacks.append(time_collections)
+    try:
+        for name, run in (("new documents", lambda: create_and_discard(factory=_DetailedDocumentCreator())),
+                          ("pooled documents", lambda: create_and_release(factory=PooledDocumentCreator(factory=_DetailedDocumentCreator())))):
+            gc.collect()
+            pauses.clear()
+            run_started_at = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - run_started_at
+            print(f"{name}: {elapsed:.2f}s, {len(pauses)} collections, {sum(pauses) * 1e3:.1f}ms total pause, "
+                  f"{max(pauses, default=0) * 1e6:.0f}us longest pause")
+    finally:
+        gc.callbacks.remove(time_collections)
+
+
 def main():
     modern_factory = ModernDocumentCreator()
     fancy_factory = FancyDocumentCreator()
@@ -87,6 +243,21 @@ def main():
     client(factory=modern_factory)
     client(factory=fancy_factory)
 
+    pooled_factory = PooledDocumentCreator(factory=fancy_factory)
+    resume = pooled_factory.create_resume()
+    pooled_factory.release(document=resume)
+    assert pooled_factory.create_resume() is resume
+    pooled_factory.release(document=resume)
+    try:
+        pooled_factory.release(document=resume)
+        assert False, "a document released twice should be rejected"
+    except ValueError:
+        pass
+    client(factory=pooled_factory)
+
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
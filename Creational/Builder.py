@@ -6,41 +6,364 @@ Example: You want to build a query, querying certain aspects
 
 from __future__ import annotations
 
+import itertools
+import os
+import queue
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
 
 class QueryOperation:
-    def __init__(self, something_useful_for_the_query: str):
+    # How expensive each kind of operation is relative to the others, the planner runs cheap operations first
+    COSTS = {"equals": 1, "contains": 10}
+    # The condition each kind of operation becomes in the WHERE clause, the operation's property is bound to the placeholder
+    SQL_CONDITIONS = {"equals": "word = ?", "contains": "instr(word, ?) > 0"}
+
+    def __init__(self, something_useful_for_the_query: str, kind: str = "equals"):
+        if kind not in self.COSTS:
+            raise ValueError(f"unknown operation kind {kind}")
         self._property = something_useful_for_the_query
+        self.kind = kind
+
+    @property
+    def cost(self) -> int:
+        return self.COSTS[self.kind]
+
+    @property
+    def fingerprint(self) -> (str, str):
+        return self.kind, self._property
+
+    def is_implied_by(self, other: QueryOperation) -> bool:
+        # Whether every row kept by other is also kept by this operation, in which case this one is redundant next to it
+        if self.kind == "contains" and other.kind in ("contains", "equals"):
+            return self._property in other._property
+        return self.fingerprint == other.fingerprint
+
+    @property
+    def parameter(self) -> str:
+        return self._property
+
+    def __repr__(self) -> str:
+        return f"{self.kind}({self._property!r})"
+
+
+class QueryPlan:
+    """
+    The operations of a query after planning: operations implied by another one are dropped, and the rest are ordered cheapest first.
+    """
+
+    def __init__(self, operations: [QueryOperation]):
+        remaining = []
+        for index, operation in enumerate(operations):
+            # Of two identical operations only the first is kept
+            implied = any(operation.is_implied_by(other) and not (other.is_implied_by(operation) and other_index > index)
+                          for other_index, other in enumerate(operations) if other_index != index)
+            if not implied:
+                remaining.append(operation)
+        self.operations: (QueryOperation, ...) = tuple(sorted(remaining, key=lambda operation: operation.cost))
+        # Queries with the same shape share their SQL and so their prepared statement, only the parameters differ
+        self.shape: (str, ...) = tuple(operation.kind for operation in self.operations)
+        self.parameters: (str, ...) = tuple(operation.parameter for operation in self.operations)
+
+    def __repr__(self) -> str:
+        return f"QueryPlan({list(self.operations)})"
+
+
+class QueryPlanner:
+    """
+    Plans queries, and keeps the plans of the `capacity` most recently planned operation lists so building the same query again doesn't plan it again.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.__capacity = capacity
+        self.__plans: OrderedDict[tuple, QueryPlan] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.planning_time = 0.0
+
+    def plan(self, operations: [QueryOperation]) -> QueryPlan:
+        fingerprint = tuple(operation.fingerprint for operation in operations)
+        with self.__lock:
+            plan = self.__plans.get(fingerprint)
+            if plan is not None:
+                self.__plans.move_to_end(fingerprint)
+                self.cache_hits += 1
+                return plan
+            self.cache_misses += 1
+
+        started_at = time.perf_counter()
+        plan = QueryPlan(operations=operations)
+        with self.__lock:
+            self.planning_time += time.perf_counter() - started_at
+            self.__plans[fingerprint] = plan
+            if len(self.__plans) > self.__capacity:
+                self.__plans.popitem(last=False)
+        return plan
+
+
+default_query_planner = QueryPlanner()
+
+
+class ConnectionPool:
+    """
+    Hands out at most `max_connections` SQLite connections, connect() blocks while they are all in use. Each connection keeps up to
+    `cached_statements` prepared statements, so running SQL it has seen before skips compiling it again.
+    """
+
+    def __init__(self, database: str, max_connections: int = 8, cached_statements: int = 256):
+        self.__database = database
+        self.__cached_statements = cached_statements
+        self.__idle: queue.LifoQueue = queue.LifoQueue()
+        self.__available = threading.BoundedSemaphore(max_connections)
+
+    def __new_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.__database, uri=True, check_same_thread=False, cached_statements=self.__cached_statements)
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        self.__available.acquire()
+        try:
+            try:
+                connection = self.__idle.get_nowait()
+            except queue.Empty:
+                connection = self.__new_connection()
+            try:
+                yield connection
+            finally:
+                # Whatever the caller left uncommitted, e.g. because it raised halfway through a write, is rolled back before the connection is
+                # reused. A connection that can't be rolled back is in an unknown state, so it is closed instead of going back to the pool
+                try:
+                    if connection.in_transaction:
+                        connection.rollback()
+                except sqlite3.Error:
+                    connection.close()
+                else:
+                    self.__idle.put(connection)
+        finally:
+            self.__available.release()
+
+    def close(self):
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class QueryDatabase:
+    """
+    Runs query plans against a SQLite table of words, which stands in for the real store. Defaults to a private database in a temporary directory,
+    removed again by close().
+
+    The database is put in WAL mode, so queries keep running while a write is in progress. Writes are still one at a time, insert_words() calls
+    from several threads take turns. Don't point this at a shared in-memory database (mode=memory&cache=shared), readers there fail with
+    "database table is locked" while another connection writes.
+    """
+    # SQLite refuses compound selects of more than 500 parts, run_many() splits larger batches
+    MAX_QUERIES_PER_STATEMENT = 500
+
+    def __init__(self, database: Optional[str] = None, max_connections: int = 8):
+        self.__directory: Optional[tempfile.TemporaryDirectory] = None
+        if database is None:
+            self.__directory = tempfile.TemporaryDirectory(prefix="query_builder_")
+            database = os.path.join(self.__directory.name, "words.db")
+        with sqlite3.connect(database, uri=True) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS words (word TEXT NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS words_word ON words (word)")
+        connection.close()
+        self.__pool = ConnectionPool(database=database, max_connections=max_connections)
+        self.__write_lock = threading.Lock()
+        self.__sql: {(str, ...): str} = {}
+        self.__lock = threading.Lock()
+        self.queries_run = 0
+        self.total_latency = 0.0
+
+    def insert_words(self, words: [str]):
+        with self.__write_lock, self.__pool.connect() as connection:
+            connection.executemany("INSERT INTO words (word) VALUES (?)", ((word,) for word in words))
+            connection.commit()
+
+    def __where_clause(self, shape: (str, ...)) -> str:
+        if not shape:
+            return ""
+        return " WHERE " + " AND ".join(QueryOperation.SQL_CONDITIONS[kind] for kind in shape)
+
+    def __sql_for(self, shape: (str, ...)) -> str:
+        sql = self.__sql.get(shape)
+        if sql is None:
+            sql = f"SELECT word FROM words{self.__where_clause(shape)} ORDER BY rowid"
+            self.__sql[shape] = sql
+        return sql
+
+    def __record(self, number_of_queries: int, started_at: float):
+        with self.__lock:
+            self.queries_run += number_of_queries
+            self.total_latency += time.perf_counter() - started_at
+
+    def execute(self, plan: QueryPlan) -> [str]:
+        started_at = time.perf_counter()
+        with self.__pool.connect() as connection:
+            rows = connection.execute(self.__sql_for(plan.shape), plan.parameters).fetchall()
+        self.__record(number_of_queries=1, started_at=started_at)
+        return [word for (word,) in rows]
+
+    def execute_many(self, plans: [QueryPlan]) -> [[str]]:
+        # The whole batch is one statement, each query's rows are tagged with the query's position in the batch
+        started_at = time.perf_counter()
+        results: [[str]] = [[] for _ in plans]
+        with self.__pool.connect() as connection:
+            for start in range(0, len(plans), self.MAX_QUERIES_PER_STATEMENT):
+                batch = plans[start:start + self.MAX_QUERIES_PER_STATEMENT]
+                sql = " UNION ALL ".join(f"SELECT ? AS query_index, rowid AS row, word FROM words{self.__where_clause(plan.shape)}" for plan in batch)
+                parameters = [parameter for index, plan in enumerate(batch, start=start) for parameter in (index, *plan.parameters)]
+                for query_index, _, word in connection.execute(sql + " ORDER BY query_index, row", parameters):
+                    results[query_index].append(word)
+        self.__record(number_of_queries=len(plans), started_at=started_at)
+        return results
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.queries_run if self.queries_run else 0.0
+
+    def close(self):
+        self.__pool.close()
+        if self.__directory is not None:
+            self.__directory.cleanup()
 
 
 class Query:
     _operations: [QueryOperation]
 
-    def __init__(self, operations: [QueryOperation]):
+    def __init__(self, operations: [QueryOperation], planner: Optional[QueryPlanner] = None):
         self._operations = operations
+        self._planner = planner if planner is not None else default_query_planner
+
+    def plan(self) -> QueryPlan:
+        return self._planner.plan(operations=self._operations)
+
+    def run(self, database: QueryDatabase) -> [str]:
+        return database.execute(plan=self.plan())
+
+
+def run_many(queries: [Query], database: QueryDatabase) -> [[str]]:
+    return database.execute_many(plans=[query.plan() for query in queries])
 
-    def run(self):
-        print(self._operations)
+
+class OperationChain:
+    """
+    Immutable linked list of operations, each link pointing back at the operations added before it. Adding an operation creates one link and shares
+    everything before it, so any number of chains can branch off a common prefix without copying it.
+    """
+    __slots__ = ("operation", "previous", "length")
+
+    def __init__(self, operation: QueryOperation, previous: Optional[OperationChain]):
+        self.operation = operation
+        self.previous = previous
+        self.length = 1 if previous is None else previous.length + 1
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[QueryOperation]:
+        # Links point backwards, so walk them into a temporary list to iterate in the order the operations were added
+        operations = []
+        link = self
+        while link is not None:
+            operations.append(link.operation)
+            link = link.previous
+        return reversed(operations)
+
+    def __getitem__(self, index: int) -> QueryOperation:
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("operation index out of range")
+        link = self
+        for _ in range(self.length - 1 - index):
+            link = link.previous
+        return link.operation
 
 
 class QueryBuilder:
-    _operations: [QueryOperation] = []
+    """
+    Builders are immutable, each add_* returns a new builder. Forking a builder is O(1), e.g. a common prefix of operations can be reused with
+    different filters, and the prefix is shared by every builder and query made from it.
+    """
+
+    def __init__(self, operations: Optional[OperationChain] = None):
+        self._operations = operations
 
     def add_some_operation1(self, data: str) -> QueryBuilder:
-        self._operations.append(QueryOperation(data))
-        return self
+        return QueryBuilder(operations=OperationChain(operation=QueryOperation(data, kind="equals"), previous=self._operations))
 
     def add_some_operation2(self, data: str) -> QueryBuilder:
-        self._operations.append(QueryOperation(data))
-        return self
+        return QueryBuilder(operations=OperationChain(operation=QueryOperation(data, kind="contains"), previous=self._operations))
 
     def build(self) -> Query:
-        return Query(operations=self._operations)
+        return Query(operations=self._operations if self._operations is not None else ())
+
+
+def benchmark(number_of_threads: int = 8, queries_per_thread: int = 2_000):
+    database = QueryDatabase(max_connections=number_of_threads)
+    database.insert_words(words=[f"word {index}" for index in range(100_000)])
+    queries = [Query(operations=[QueryOperation(f"word {index}", kind="equals")]) for index in range(100)]
+
+    def run_queries(_) -> [float]:
+        latencies = []
+        for index in range(queries_per_thread):
+            started_at = time.perf_counter()
+            queries[index % len(queries)].run(database=database)
+            latencies.append(time.perf_counter() - started_at)
+        return latencies
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+        latencies = sorted(itertools.chain.from_iterable(executor.map(run_queries, range(number_of_threads))))
+    elapsed = time.perf_counter() - started_at
+    print(f"{number_of_threads} threads: {len(latencies) / elapsed:.0f} queries/s, median latency {statistics.median(latencies) * 1e6:.0f}us, "
+          f"p99 latency {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us")
+
+    started_at = time.perf_counter()
+    for _ in range(number_of_threads * queries_per_thread // len(queries)):
+        run_many(queries=queries, database=database)
+    elapsed = time.perf_counter() - started_at
+    print(f"run_many in batches of {len(queries)}: {number_of_threads * queries_per_thread / elapsed:.0f} queries/s")
+    database.close()
 
 
 def main():
-    query = QueryBuilder().add_some_operation1("data").add_some_operation2("data 2").build()
-    query.run()
+    query = QueryBuilder().add_some_operation2("data").add_some_operation2("dat").add_some_operation1("other").build()
+    print(query.plan())
+    # contains("dat") is implied by contains("data"), and the cheap equals runs first
+    assert query.plan().operations == (query._operations[2], query._operations[0])
+    print(f"cache hits={default_query_planner.cache_hits} misses={default_query_planner.cache_misses} "
+          f"planning time={default_query_planner.planning_time * 1e6:.0f}us")
+
+    database = QueryDatabase()
+    database.insert_words(words=["other", "some data", "other data", "other"])
+    assert query.run(database=database) == []
+    other_query = QueryBuilder().add_some_operation1("other").build()
+    assert run_many(queries=[other_query, query], database=database) == [["other", "other"], []]
+    database.close()
+
+    base_builder = QueryBuilder().add_some_operation2("data")
+    variants = [base_builder.add_some_operation1(f"other {index}").build() for index in range(3)]
+    assert all(variant._operations.previous is base_builder._operations for variant in variants)
+    assert len(base_builder.build()._operations) == 1
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
@@ -5,9 +5,33 @@ Example: You want to serialize some data, but you may want "JSON" or "XML" seria
 this data
 
 """
+import io
+import itertools
+import json
+import os
+import pickle
+import re
+import sys
+import threading
+import timeit
+import tracemalloc
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from typing import Dict
+from typing import Callable, Dict, Hashable, Iterable, Iterator, Optional, Union
+from xml.sax.saxutils import escape
+
+
+# Streamed output is written in chunks of about this many bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _writer_for(writable) -> Callable[[bytes], None]:
+    # A bytearray is extended in place, anything else is treated as a binary file like object
+    if isinstance(writable, bytearray):
+        return writable.extend
+    return writable.write
 
 
 class SerializerInterface(ABC):
@@ -16,38 +40,335 @@ class SerializerInterface(ABC):
     def serialize(self, data: Dict) -> str:
         pass
 
+    def serialize_to(self, data: Dict, writable):
+        """
+        Writes the serialized data, UTF-8 encoded for text formats, to a binary file or a bytearray. Serializers that can, override this to write the
+        output in chunks as it is produced, rather than building all of it first.
+        """
+        output = self.serialize(data=data)
+        _writer_for(writable)(output.encode("utf-8") if isinstance(output, str) else output)
+
 
 class SerializerFormat(Enum):
     json = 0
     xml = 1
+    binary = 2
 
 
 class JSONSerialization(SerializerInterface):
 
+    def __init__(self):
+        # One encoder is reused for every call. Compact separators and skipping the circular reference check make it noticeably faster
+        self.__encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False, ensure_ascii=False)
+
     def serialize(self, data: Dict) -> str:
-        # Implementation omitted
-        pass
+        return self.__encoder.encode(data)
+
+    # The top levels of the data, and deeper containers with more items than this, are written item by item. Everything else is encoded in one go
+    __STREAMED_DEPTH = 2
+    __STREAMED_CONTAINER_SIZE = 64
+
+    def serialize_to(self, data: Dict, writable):
+        # JSONEncoder.iterencode() falls back to the pure Python encoder, so instead only the large containers are walked here and everything inside
+        # them is still encoded by the C encoder
+        write = _writer_for(writable)
+        chunk: [str] = []
+        chunk_size = [0]
+
+        def emit(part: str):
+            chunk.append(part)
+            chunk_size[0] += len(part)
+            if chunk_size[0] >= STREAM_CHUNK_SIZE:
+                write("".join(chunk).encode("utf-8"))
+                chunk.clear()
+                chunk_size[0] = 0
+
+        self.__stream_value(value=data, emit=emit, depth=0)
+        if chunk:
+            write("".join(chunk).encode("utf-8"))
+
+    def __stream_value(self, value, emit: Callable[[str], None], depth: int):
+        streamed = isinstance(value, (dict, list, tuple)) and (depth < self.__STREAMED_DEPTH or len(value) > self.__STREAMED_CONTAINER_SIZE)
+        if streamed and isinstance(value, dict) and value:
+            separator = "{"
+            for key, item in value.items():
+                # encode() on a one item dict takes care of converting and escaping the key like json does
+                emit(separator + self.__encoder.encode({key: None})[1:-5])
+                self.__stream_value(value=item, emit=emit, depth=depth + 1)
+                separator = ","
+            emit("}")
+        elif streamed and isinstance(value, (list, tuple)) and value:
+            separator = "["
+            for item in value:
+                emit(separator)
+                self.__stream_value(value=item, emit=emit, depth=depth + 1)
+                separator = ","
+            emit("]")
+        else:
+            emit(self.__encoder.encode(value))
 
 
 class XMLSerialization(SerializerInterface):
+    """
+    Serializes to <root>...</root>, with one element per key. List items become <item> elements, and None becomes an empty element.
+    """
+    __VALID_NAME = re.compile(r"[A-Za-z_][\w.-]*\Z")
+    # Records usually repeat the same keys, so each key is only validated and turned into tags once
+    __MAX_CACHED_TAGS = 10_000
+
+    def __init__(self):
+        self.__tags: {str: (str, str)} = {}
+
+    def __make_tags(self, key) -> (str, str):
+        name = str(key)
+        if not self.__VALID_NAME.match(name) or name.lower().startswith("xml"):
+            raise ValueError(f"{name!r} can't be used as an XML element name")
+        if len(self.__tags) >= self.__MAX_CACHED_TAGS:
+            self.__tags.clear()
+        tags = self.__tags[key] = (f"<{name}>", f"</{name}>")
+        return tags
 
     def serialize(self, data: Dict) -> str:
-        # Implementation omitted
+        # The output is collected as a list of parts and joined once at the end
+        parts: [str] = ["<root>"]
+        self.__serialize_value(value=data, parts=parts, flush=None)
+        parts.append("</root>")
+        return "".join(parts)
+
+    def serialize_to(self, data: Dict, writable):
+        write = _writer_for(writable)
+        parts: [str] = ["<root>"]
+
+        def flush():
+            write("".join(parts).encode("utf-8"))
+            parts.clear()
+
+        self.__serialize_value(value=data, parts=parts, flush=flush)
+        parts.append("</root>")
+        flush()
+
+    # Parts are mostly short tags and values, so this many of them make a chunk of roughly STREAM_CHUNK_SIZE bytes
+    __PARTS_PER_CHUNK = STREAM_CHUNK_SIZE // 8
+
+    def __serialize_value(self, value, parts: [str], flush: Optional[Callable[[], None]]):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                tags = self.__tags.get(key)
+                if tags is None:
+                    tags = self.__make_tags(key=key)
+                parts.append(tags[0])
+                self.__serialize_value(value=item, parts=parts, flush=flush)
+                parts.append(tags[1])
+                if flush is not None and len(parts) >= self.__PARTS_PER_CHUNK:
+                    flush()
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                parts.append("<item>")
+                self.__serialize_value(value=item, parts=parts, flush=flush)
+                parts.append("</item>")
+                if flush is not None and len(parts) >= self.__PARTS_PER_CHUNK:
+                    flush()
+        elif isinstance(value, str):
+            parts.append(escape(value))
+        elif isinstance(value, bool):
+            parts.append("true" if value else "false")
+        elif value is not None:
+            parts.append(escape(str(value)))
+
+
+class BinarySerialization(SerializerInterface):
+    """
+    Compact binary format for traffic between our own services, the data is pickled. Never load it from a source you don't trust. serialize() returns
+    bytes rather than a str.
+    """
+
+    def serialize(self, data: Dict) -> bytes:
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def serialize_to(self, data: Dict, writable):
+        # The pickler writes in frames of about 64KB as it goes
+        if isinstance(writable, bytearray):
+            writable = _BytearrayWriter(target=writable)
+        pickle.dump(data, writable, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class _BytearrayWriter(io.RawIOBase):
+
+    def __init__(self, target: bytearray):
+        super().__init__()
+        self.__target = target
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.__target += data
+        return len(data)
+
+
+# Formats map to a function creating their serializer. A serializer is only created the first time its format is asked for, and then reused
+_serializer_constructors: {Hashable: Callable[[], SerializerInterface]} = {
+    SerializerFormat.json: JSONSerialization,
+    SerializerFormat.xml: XMLSerialization,
+    SerializerFormat.binary: BinarySerialization,
+}
+_serializers: {Hashable: SerializerInterface} = {}
+_serializers_lock = threading.Lock()
+
+
+def register_serializer(serialization_format: Hashable, constructor: Callable[[], SerializerInterface]):
+    # Formats added at runtime can be members of another Enum, or any other hashable value
+    with _serializers_lock:
+        _serializer_constructors[serialization_format] = constructor
+        _serializers.pop(serialization_format, None)
+
+
+def serializer_factory(serialization_format: Union[SerializerFormat, Hashable]) -> SerializerInterface:
+    serializer = _serializers.get(serialization_format)
+    if serializer is not None:
+        return serializer
+
+    with _serializers_lock:
+        serializer = _serializers.get(serialization_format)
+        if serializer is None:
+            constructor = _serializer_constructors.get(serialization_format)
+            if constructor is None:
+                raise ValueError(f"no serializer registered for {serialization_format}")
+            serializer = _serializers[serialization_format] = constructor()
+        return serializer
+
+
+def _serialize_chunk(serialization_format: Hashable, records: [Dict]) -> list:
+    serializer = serializer_factory(serialization_format=serialization_format)
+    return [serializer.serialize(data=record) for record in records]
+
+
+def serialize_many(records: Iterable[Dict], serialization_format: Union[SerializerFormat, Hashable], workers: Optional[int] = None,
+                   chunk_size: int = 1_000) -> Iterator[Union[str, bytes]]:
+    """
+    Serializes every record, yielding the results in the same order as the records. Records are sent in chunks of `chunk_size` to a pool of `workers`
+    processes (one per core by default), so serializing isn't limited by the GIL. Only a few chunks per worker are in flight at once, so records can
+    be streamed in and results streamed out.
+
+    The format's constructor is registered again in every worker, so formats added with register_serializer() work whichever way the platform
+    starts processes. Unless the workers are forked, the constructor has to be picklable, e.g. a class or a function defined at module level.
+    """
+    # Arguments are checked here, when serialize_many() is called, rather than on the first next() of the generator it returns
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1 or chunk_size < 1:
+        raise ValueError("workers and chunk_size must be at least 1")
+    with _serializers_lock:
+        constructor = _serializer_constructors.get(serialization_format)
+    if constructor is None:
+        raise ValueError(f"no serializer registered for {serialization_format}")
+    return _serialize_many(records=records, serialization_format=serialization_format, constructor=constructor, workers=workers,
+                           chunk_size=chunk_size)
+
+
+def _serialize_many(records: Iterable[Dict], serialization_format: Union[SerializerFormat, Hashable], constructor: Callable[[], SerializerInterface],
+                    workers: int, chunk_size: int) -> Iterator[Union[str, bytes]]:
+    records = iter(records)
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+    if workers == 1:
+        for chunk in chunks:
+            yield from _serialize_chunk(serialization_format=serialization_format, records=chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=register_serializer, initargs=(serialization_format, constructor)) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+            in_flight.append(executor.submit(_serialize_chunk, serialization_format, chunk))
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def _payload(number_of_records: int) -> Dict:
+    return {"records": [{"id": index, "name": f"record <{index}>", "score": index / 3, "active": index % 2 == 0, "tags": ["a", "b"]}
+                        for index in range(number_of_records)]}
+
+
+def benchmark():
+    payloads = {"small": _payload(number_of_records=10), "medium": _payload(number_of_records=1_000), "large": _payload(number_of_records=100_000)}
+    for serialization_format in SerializerFormat:
+        serializer = serializer_factory(serialization_format=serialization_format)
+        for size, payload in payloads.items():
+            output = serializer.serialize(data=payload)
+            output_size = len(output.encode("utf-8") if isinstance(output, str) else output)
+            number = max(1, 10_000_000 // output_size)
+            elapsed = min(timeit.repeat(lambda: serializer.serialize(data=payload), number=number, repeat=3))
+            print(f"{serialization_format.name} {size} ({output_size} bytes): {output_size * number / elapsed / 2 ** 20:.1f}MB/s")
+
+
+class _DiscardingWriter:
+
+    def write(self, data: bytes):
         pass
 
 
-def serializer_factory(serialization_format: SerializerFormat) -> SerializerInterface:
-    if serialization_format == SerializerFormat.json:
-        return JSONSerialization()
-    elif serialization_format == SerializerFormat.xml:
-        return XMLSerialization()
+def benchmark_streaming():
+    # Compares writing a large payload through serialize() with serialize_to(), the writer throws the output away so only serializing is measured
+    payload = _payload(number_of_records=200_000)
+    for serialization_format in SerializerFormat:
+        serializer = serializer_factory(serialization_format=serialization_format)
+
+        def string_path():
+            output = serializer.serialize(data=payload)
+            _DiscardingWriter().write(output.encode("utf-8") if isinstance(output, str) else output)
+
+        def streaming_path():
+            serializer.serialize_to(data=payload, writable=_DiscardingWriter())
+
+        for name, path in (("serialize", string_path), ("serialize_to", streaming_path)):
+            tracemalloc.start()
+            path()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            elapsed = min(timeit.repeat(path, number=1, repeat=3))
+            print(f"{serialization_format.name} {name}: peak {peak_memory / 2 ** 20:.1f}MiB, {elapsed:.2f}s")
+
+
+def benchmark_serialize_many(number_of_records: int = 500_000):
+    records = _payload(number_of_records=number_of_records)["records"]
+    workers = 1
+    while True:
+        elapsed = timeit.timeit(lambda: sum(1 for _ in serialize_many(records=records, serialization_format=SerializerFormat.json, workers=workers)),
+                                number=1)
+        print(f"serialize_many with {workers} workers: {number_of_records / elapsed:.0f} records/s")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count() or 1)
 
 
 def main():
     data = {"test_data": 0}
     serialize = serializer_factory(serialization_format=SerializerFormat.json)
-    serialize.serialize(data=data)
+    assert serialize.serialize(data=data) == '{"test_data":0}'
+    assert serializer_factory(serialization_format=SerializerFormat.json) is serialize
+
+    xml_serializer = serializer_factory(serialization_format=SerializerFormat.xml)
+    assert xml_serializer.serialize(data={"a": [1, "<b>"], "c": None}) == "<root><a><item>1</item><item>&lt;b&gt;</item></a><c></c></root>"
+
+    large_data = _payload(number_of_records=10_000)
+    for serialization_format in SerializerFormat:
+        serializer = serializer_factory(serialization_format=serialization_format)
+        output = bytearray()
+        serializer.serialize_to(data=large_data, writable=output)
+        expected = serializer.serialize(data=large_data)
+        assert output == (expected.encode("utf-8") if isinstance(expected, str) else expected)
+
+    records = large_data["records"]
+    json_serializer = serializer_factory(serialization_format=SerializerFormat.json)
+    assert list(serialize_many(records=records, serialization_format=SerializerFormat.json, workers=2, chunk_size=100)) == \
+           [json_serializer.serialize(data=record) for record in records]
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+        benchmark_streaming()
+        benchmark_serialize_many()
+    else:
+        main()
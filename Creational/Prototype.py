@@ -10,6 +10,10 @@ Another reason to use this pattern is when cloning is time consuming/requires mo
 Its called prototype because the class that implements .clone() is consider the prototype, and its values are copied to
 the clone.
 """
+from __future__ import annotations
+
+import sys
+import timeit
 from abc import ABC, abstractmethod
 
 
@@ -20,13 +24,106 @@ class CloneInterface(ABC):
     def clone(self):
         pass
 
+    def clone_many(self, number_of_clones: int) -> list:
+        return [self.clone() for _ in range(number_of_clones)]
+
 
 class SomeClassWeWanToClone(CloneInterface):
+    """
+    Clones are copy on write: a clone shares its prototype's state until either of them is first changed, and only then gets a copy of its own. So a
+    clone costs the same however much state there is, and no constructor is run.
+    """
 
     def __init__(self, int_value: int, string_value: str):
-        self.__int_value = int_value
-        self.__string_value = string_value
+        self.__state = {"int_value": int_value, "string_value": string_value}
+        self.__state_is_shared = False
 
-    def clone(self):
+    @property
+    def int_value(self) -> int:
+        return self.__state["int_value"]
+
+    @property
+    def string_value(self) -> str:
+        return self.__state["string_value"]
+
+    def set_int_value(self, int_value: int):
+        self.__write("int_value", int_value)
+
+    def set_string_value(self, string_value: str):
+        self.__write("string_value", string_value)
+
+    def __write(self, name: str, value):
+        if self.__state_is_shared:
+            self.__state = dict(self.__state)
+            self.__state_is_shared = False
+        self.__state[name] = value
+
+    def clone(self) -> SomeClassWeWanToClone:
         # Notice that if we wanted to clone this class from the outside, it would be impossible since int_value and _string_value are private
-        return SomeClassWeWanToClone(int_value=self.__int_value, string_value=self.__string_value)
+        self.__state_is_shared = True
+        clone = object.__new__(type(self))
+        clone.__state = self.__state
+        clone.__state_is_shared = True
+        return clone
+
+    def clone_many(self, number_of_clones: int) -> [SomeClassWeWanToClone]:
+        # Once cloned, the prototype has to copy its state before it next changes it, as well as the clones
+        self.__state_is_shared = True
+        cls = type(self)
+        state = self.__state
+        clones = [object.__new__(cls) for _ in range(number_of_clones)]
+        for clone in clones:
+            clone.__state = state
+            clone.__state_is_shared = True
+        return clones
+
+
+class PrototypeRegistry:
+    """
+    Named, preconfigured prototypes. Objects are made by cloning the registered prototype rather than by constructing and configuring a new one.
+    """
+
+    def __init__(self):
+        self.__prototypes: {str: CloneInterface} = {}
+
+    def register(self, name: str, prototype: CloneInterface):
+        self.__prototypes[name] = prototype
+
+    def unregister(self, name: str):
+        del self.__prototypes[name]
+
+    def __get(self, name: str) -> CloneInterface:
+        prototype = self.__prototypes.get(name)
+        if prototype is None:
+            raise KeyError(f"no prototype registered as {name!r}")
+        return prototype
+
+    def clone(self, name: str):
+        return self.__get(name).clone()
+
+    def clone_many(self, name: str, number_of_clones: int) -> list:
+        return self.__get(name).clone_many(number_of_clones=number_of_clones)
+
+
+def benchmark(number_of_objects: int = 1_000_000):
+    prototype = SomeClassWeWanToClone(int_value=1, string_value="configured")
+    construct_time = timeit.timeit(lambda: [SomeClassWeWanToClone(int_value=1, string_value="configured") for _ in range(number_of_objects)], number=1)
+    clone_time = timeit.timeit(lambda: [prototype.clone() for _ in range(number_of_objects)], number=1)
+    clone_many_time = timeit.timeit(lambda: prototype.clone_many(number_of_clones=number_of_objects), number=1)
+    print(f"{number_of_objects} objects: constructor {construct_time:.2f}s, clone {clone_time:.2f}s, clone_many {clone_many_time:.2f}s")
+
+
+def main():
+    registry = PrototypeRegistry()
+    registry.register(name="default", prototype=SomeClassWeWanToClone(int_value=1, string_value="configured"))
+    clones = registry.clone_many(name="default", number_of_clones=3)
+    clones[0].set_int_value(int_value=2)
+    assert [clone.int_value for clone in clones] == [2, 1, 1]
+    assert registry.clone(name="default").int_value == 1
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
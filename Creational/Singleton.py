@@ -5,16 +5,94 @@ Example: You have a class which holds global app settings. There is no point in
 entire app settings.
 
 """
+import os
+import sys
+import threading
+import time
+import weakref
+
+# Guards creating instances. Re-entrant, so init() of one singleton can use another one
+_lock = threading.RLock()
+_singleton_classes: weakref.WeakSet = weakref.WeakSet()
 
 
 class Singleton(object):
+    """
+    Thread safe: the instance is created under a lock, and only published once init() has finished, so racing threads can't create two instances or
+    see a half initialised one. Once it exists, getting it takes no lock.
+
+    Classes setting `reinitialize_after_fork = True` get a new instance in a forked child process, rather than sharing the parent's one, which may hold
+    sockets or threads that don't survive the fork.
+    """
+    reinitialize_after_fork = False
+
     def __new__(cls, *args, **kwds):
         it = cls.__dict__.get("__it__")
         if it is not None:
             return it
-        cls.__it__ = it = object.__new__(cls)
-        it.init(*args, **kwds)
-        return it
+        with _lock:
+            it = cls.__dict__.get("__it__")
+            if it is not None:
+                return it
+            it = object.__new__(cls)
+            it.init(*args, **kwds)
+            _singleton_classes.add(cls)
+            cls.__it__ = it
+            return it
 
     def init(self, *args, **kwds):
         pass
+
+
+def _after_fork_in_child():
+    global _lock
+    # Another thread may have held the lock when the process forked, that thread doesn't exist in the child to release it
+    _lock = threading.RLock()
+    for cls in list(_singleton_classes):
+        if cls.reinitialize_after_fork and "__it__" in cls.__dict__:
+            del cls.__it__
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class _CountedSingleton(Singleton):
+    instances_created = 0
+
+    def init(self, *args, **kwds):
+        # Makes the race window on first use wide
+        time.sleep(0.01)
+        type(self).instances_created += 1
+
+
+def benchmark(number_of_threads: int = 32, lookups_per_thread: int = 100_000):
+    start = threading.Barrier(number_of_threads + 1)
+
+    def look_up():
+        start.wait()
+        for _ in range(lookups_per_thread):
+            _CountedSingleton()
+
+    threads = [threading.Thread(target=look_up) for _ in range(number_of_threads)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    print(f"{number_of_threads} threads: {number_of_threads * lookups_per_thread / elapsed:.0f} lookups/s, "
+          f"{_CountedSingleton.instances_created} instance created")
+
+
+def main():
+    assert Singleton() is Singleton()
+    assert _CountedSingleton() is not Singleton()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()
@@ -7,6 +7,13 @@ Example: You have a shape class. You want to draw it at x and y coordinate. This
 a shape, e.g. a red square can be cached and re-used whenever you need a red square.
 
 """
+import itertools
+import sys
+import threading
+import timeit
+import tracemalloc
+from array import array
+from collections import OrderedDict
 
 
 class FlyWeightShape:
@@ -19,25 +26,150 @@ class FlyWeightShape:
         # Implemenentation omitted
         pass
 
+    def draw_many(self, x_coordinates, y_coordinates):
+        # Takes any buffer of ints (array('i'), numpy arrays, ...) so a whole batch is drawn with one method call instead of one call per point
+        x_view = memoryview(x_coordinates)
+        y_view = memoryview(y_coordinates)
+        if len(x_view) != len(y_view):
+            raise ValueError("x and y coordinates must have the same length")
+        # Implemenentation omitted
+        pass
 
-class FlyWeightContainer:
-    __flyweights: {(str, str): FlyWeightShape} = {}
 
-    def __init__(self, required_initial_flyweights: [(str, str)]):
+class FlyWeightContainer:
+    """
+    Interning pool for flyweights. The pool is bounded, once it holds `capacity` shapes the least recently used one is evicted, so memory stays flat
+    no matter how large the (color, shape) key space is. Lookups are guarded by a lock so the container can be shared between threads.
+    """
+
+    def __init__(self, required_initial_flyweights: [(str, str)], capacity: int = 1024):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.__capacity = capacity
+        self.__flyweights: OrderedDict[(str, str), FlyWeightShape] = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
         for (color, shape) in required_initial_flyweights:
-            self.__flyweights[(color, shape)] = FlyWeightShape(color=color, shape=shape)
+            self.__store(cache_key=(color, shape), flyweight=FlyWeightShape(color=color, shape=shape))
 
-    def get_fly_weight_shape(self, color: str, shape: str):
-        cache_key = (color, shape)
-        cached_value = self.__flyweights.get(cache_key)
-        if cached_value is not None:
-            print("found cached value")
-            return cached_value
+    def __store(self, cache_key: (str, str), flyweight: FlyWeightShape):
+        self.__flyweights[cache_key] = flyweight
+        if len(self.__flyweights) > self.__capacity:
+            self.__flyweights.popitem(last=False)
+            self.evictions += 1
 
-        print("didn't find cached value")
-        new_flyweight = FlyWeightShape(color=color, shape=shape)
-        self.__flyweights[cached_value] = new_flyweight
-        return new_flyweight
+    def get_fly_weight_shape(self, color: str, shape: str) -> FlyWeightShape:
+        cache_key = (color, shape)
+        with self.__lock:
+            cached_value = self.__flyweights.get(cache_key)
+            if cached_value is not None:
+                self.__flyweights.move_to_end(cache_key)
+                self.hits += 1
+                return cached_value
+
+            self.misses += 1
+            new_flyweight = FlyWeightShape(color=color, shape=shape)
+            self.__store(cache_key=cache_key, flyweight=new_flyweight)
+            return new_flyweight
+
+    def __len__(self) -> int:
+        return len(self.__flyweights)
+
+
+class FlyWeightScene:
+    """
+    Keeps the extrinsic state (the coordinates) in columns rather than as one tuple per placed shape. Placements are stored in the order they were
+    made as three columns, an array('I') of shape ids and two array('i') of x and y coordinates, so 10M placed shapes cost a few arrays of machine ints.
+
+    draw() keeps that order, which is the z-order of overlapping shapes. Each run of consecutive placements of the same shape is drawn with one
+    draw_many call on a zero-copy slice of the coordinate columns.
+    """
+
+    def __init__(self, container: FlyWeightContainer):
+        self.__container = container
+        self.__shape_ids_by_key: {(str, str): int} = {}
+        self.__flyweights: [FlyWeightShape] = []
+        self.__shape_ids = array("I")
+        self.__x_coordinates = array("i")
+        self.__y_coordinates = array("i")
+
+    def __shape_id(self, color: str, shape: str) -> int:
+        shape_id = self.__shape_ids_by_key.get((color, shape))
+        if shape_id is None:
+            shape_id = len(self.__flyweights)
+            self.__shape_ids_by_key[(color, shape)] = shape_id
+            self.__flyweights.append(self.__container.get_fly_weight_shape(color=color, shape=shape))
+        return shape_id
+
+    def place(self, color: str, shape: str, x_coordinate: int, y_coordinate: int):
+        shape_id = self.__shape_id(color=color, shape=shape)
+        self.__shape_ids.append(shape_id)
+        self.__x_coordinates.append(x_coordinate)
+        self.__y_coordinates.append(y_coordinate)
+
+    def place_many(self, color: str, shape: str, x_coordinates, y_coordinates):
+        x_view = memoryview(x_coordinates)
+        y_view = memoryview(y_coordinates)
+        if x_view.format != "i" or y_view.format != "i" or len(x_view) != len(y_view):
+            raise ValueError("coordinates must be equal length buffers of C ints, e.g. array('i') or numpy int32")
+        shape_id = self.__shape_id(color=color, shape=shape)
+        self.__shape_ids.extend(array("I", [shape_id]) * len(x_view))
+        self.__x_coordinates.frombytes(x_view.cast("B"))
+        self.__y_coordinates.frombytes(y_view.cast("B"))
+
+    def draw(self):
+        x_view = memoryview(self.__x_coordinates)
+        y_view = memoryview(self.__y_coordinates)
+        start = 0
+        for shape_id, run in itertools.groupby(self.__shape_ids):
+            stop = start + sum(1 for _ in run)
+            self.__flyweights[shape_id].draw_many(x_coordinates=x_view[start:stop], y_coordinates=y_view[start:stop])
+            start = stop
+
+    def __len__(self) -> int:
+        return len(self.__shape_ids)
+
+
+def benchmark(number_of_points: int = 1_000_000, number_of_placements: int = 10_000_000):
+    flyweight = FlyWeightShape(color="red", shape="square")
+    x_coordinates = array("i", range(number_of_points))
+    y_coordinates = array("i", range(number_of_points))
+
+    def per_call():
+        for x_coordinate, y_coordinate in zip(x_coordinates, y_coordinates):
+            flyweight.draw(x_coordinate=x_coordinate, y_coordinate=y_coordinate)
+
+    def batched():
+        flyweight.draw_many(x_coordinates=x_coordinates, y_coordinates=y_coordinates)
+
+    per_call_time = min(timeit.repeat(per_call, number=1, repeat=3))
+    batched_time = min(timeit.repeat(batched, number=1, repeat=3))
+    print(f"{number_of_points} points: per call {per_call_time:.4f}s, draw_many {batched_time:.6f}s")
+
+    # Memory of a scene of placements in columns, against the same placements as (shape, x, y) tuples
+    shapes = [("red", "square"), ("blue", "triangle"), ("green", "circle")]
+    tracemalloc.start()
+    scene = FlyWeightScene(container=FlyWeightContainer(required_initial_flyweights=shapes))
+    chunk = array("i", range(100_000))
+    for index in range(number_of_placements // len(chunk)):
+        color, shape = shapes[index % len(shapes)]
+        scene.place_many(color=color, shape=shape, x_coordinates=chunk, y_coordinates=chunk)
+    scene_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    draw_time = timeit.timeit(scene.draw, number=1)
+
+    # Tuples are measured on a tenth of the placements, 10M of them would need gigabytes
+    container = FlyWeightContainer(required_initial_flyweights=shapes)
+    flyweights = [container.get_fly_weight_shape(color=color, shape=shape) for color, shape in shapes]
+    tracemalloc.start()
+    placements = [(flyweights[index % len(flyweights)], index * 1000, index * 1000) for index in range(number_of_placements // 10)]
+    tuple_memory = tracemalloc.get_traced_memory()[0] * 10
+    tracemalloc.stop()
+    del placements
+    print(f"{len(scene)} placements: columns {scene_memory / 2 ** 20:.0f}MiB (draw {draw_time:.2f}s), "
+          f"tuples {tuple_memory / 2 ** 20:.0f}MiB (extrapolated from {number_of_placements // 10})")
 
 
 def main():
@@ -48,6 +180,19 @@ def main():
     flyweight = container.get_fly_weight_shape(color="blue", shape="square")
     flyweight.draw(x_coordinate=1, y_coordinate=34)
 
+    assert container.get_fly_weight_shape(color="blue", shape="square") is flyweight
+    print(f"hits={container.hits} misses={container.misses} evictions={container.evictions}")
+
+    scene = FlyWeightScene(container=container)
+    scene.place(color="red", shape="square", x_coordinate=1, y_coordinate=34)
+    scene.place_many(color="blue", shape="triangle", x_coordinates=array("i", [1, 2, 3]), y_coordinates=array("i", [4, 5, 6]))
+    scene.place(color="red", shape="square", x_coordinate=2, y_coordinate=35)
+    scene.draw()
+    assert len(scene) == 5
+
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["benchmark"]:
+        benchmark()
+    else:
+        main()